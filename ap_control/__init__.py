@@ -0,0 +1,68 @@
+'''
+Artificial pancreas control systems.
+
+Importable versions of the controllers described in the book chapters:
+
+    insulin     Insulin activity and insulin on board model (MPC chapter)
+    pid         PID controller (PID chapter)
+    mpc         MPC glucose prediction and controller (MPC chapter)
+    safety      Safety constraints on controller outputs
+    simulation  Vectorized closed loop simulation on simulated patient cohorts
+    tuning      Automatic PID gain tuning with ITAE
+    estimation  Patient parameter estimation from CGM and insulin history
+    service     Asyncio control service for many patients
+    replay      Replay of recorded patient logs through the controllers
+    clarke      Clarke Error Grid Analysis
+    profiling   Opt-in latency instrumentation for the controllers
+
+Importing a module has no side effects. The names below are loaded from their
+module on first use, so `import ap_control` does not import numpy, and
+Matplotlib is only imported when an error grid is plotted.
+'''
+
+import importlib
+
+
+_EXPORTS = {
+    'clarke_error_grid': 'clarke',
+    'clarke_zones': 'clarke',
+    'zone_counts': 'clarke',
+    'PatientParameters': 'estimation',
+    'fit_patient_parameters': 'estimation',
+    'IOBTracker': 'insulin',
+    'MPCController': 'mpc',
+    'predict_glucose': 'mpc',
+    'step_batch': 'mpc',
+    'PIDController': 'pid',
+    'calc_response': 'pid',
+    'NULL_PROFILER': 'profiling',
+    'ControllerProfiler': 'profiling',
+    'Replay': 'replay',
+    'read_log': 'replay',
+    'replay_many': 'replay',
+    'run_replay': 'replay',
+    'SafetyConstraints': 'safety',
+    'ControlService': 'service',
+    'FileSource': 'service',
+    'SimulatedPump': 'service',
+    'SocketSource': 'service',
+    'Cohort': 'simulation',
+    'random_cohort': 'simulation',
+    'simulate_pid': 'simulation',
+    'tune_pid': 'tuning',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
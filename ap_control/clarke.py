@@ -0,0 +1,101 @@
+'''
+Clarke Error Grid Analysis.
+
+clarke_error_grid is the function from ClarkeErrorGrid.py (Trevor Tsue, based
+on the Matlab Clarke Error Grid Analysis by Edgar Guevara Codina), see that
+file for the description of the zones. Matplotlib is only imported when a
+grid is plotted.
+
+clarke_zones and zone_counts use the same zone definitions without the plot,
+vectorized for large numbers of predictions. Values are in mg/dl; multiply
+mmol/L by MMOL_TO_MGDL first.
+
+    0=A, 1=B, 2=C, 3=D, 4=E
+'''
+
+import numpy as np
+
+
+MMOL_TO_MGDL = 18.0182
+
+
+def clarke_zones(ref_values, pred_values):
+    # Zone of every (reference, prediction) pair
+    ref = np.asarray(ref_values, dtype=float)
+    pred = np.asarray(pred_values, dtype=float)
+
+    zone_a = ((ref <= 70) & (pred <= 70)) | ((pred <= 1.2*ref) & (pred >= 0.8*ref))
+    zone_e = ((ref >= 180) & (pred <= 70)) | ((ref <= 70) & (pred >= 180))
+    zone_c = (((ref >= 70) & (ref <= 290)) & (pred >= ref + 110)) | (((ref >= 130) & (ref <= 180)) & (pred <= (7/5)*ref - 182))
+    zone_d = ((ref >= 240) & ((pred >= 70) & (pred <= 180))) | ((ref <= 175/3) & (pred <= 180) & (pred >= 70)) | \
+             (((ref >= 175/3) & (ref <= 70)) & (pred >= (6/5)*ref))
+
+    return np.select([zone_a, zone_e, zone_c, zone_d], [0, 4, 2, 3], default=1)
+
+
+def zone_counts(ref_values, pred_values):
+    # List with the number of points in each zone, like clarke_error_grid
+    return np.bincount(clarke_zones(ref_values, pred_values).ravel(), minlength=5).tolist()
+
+
+#This function takes in the reference values and the prediction values as lists and returns a list with each index corresponding to the total number
+#of points within that zone (0=A, 1=B, 2=C, 3=D, 4=E) and the plot
+def clarke_error_grid(ref_values, pred_values, title_string):
+    import matplotlib.pyplot as plt
+
+    #Checking to see if the lengths of the reference and prediction arrays are the same
+    assert (len(ref_values) == len(pred_values)), "Unequal number of values (reference : {}) (prediction : {}).".format(len(ref_values), len(pred_values))
+
+    #Checks to see if the values are within the normal physiological range, otherwise it gives a warning
+    if max(ref_values) > 400 or max(pred_values) > 400:
+        print ("Input Warning: the maximum reference value {} or the maximum prediction value {} exceeds the normal physiological range of glucose (<400 mg/dl).".format(max(ref_values), max(pred_values)))
+    if min(ref_values) < 0 or min(pred_values) < 0:
+        print ("Input Warning: the minimum reference value {} or the minimum prediction value {} is less than 0 mg/dl.".format(min(ref_values),  min(pred_values)))
+
+    #Clear plot
+    plt.clf()
+
+    #Set up plot
+    plt.scatter(ref_values, pred_values, marker='o', color='black', s=8)
+    plt.title(title_string + " Clarke Error Grid")
+    plt.xlabel("Reference Concentration (mg/dl)")
+    plt.ylabel("Prediction Concentration (mg/dl)")
+    plt.xticks([0, 50, 100, 150, 200, 250, 300, 350, 400])
+    plt.yticks([0, 50, 100, 150, 200, 250, 300, 350, 400])
+    plt.gca().set_facecolor('white')
+
+    #Set axes lengths
+    plt.gca().set_xlim([0, 400])
+    plt.gca().set_ylim([0, 400])
+    plt.gca().set_aspect((400)/(400))
+
+    #Plot zone lines
+    plt.plot([0,400], [0,400], ':', c='black')                      #Theoretical 45 regression line
+    plt.plot([0, 175/3], [70, 70], '-', c='black')
+    plt.plot([175/3, 400/1.2], [70, 400], '-', c='black')           #Replace 320 with 400/1.2 because 100*(400 - 400/1.2)/(400/1.2) =  20% error
+    plt.plot([70, 70], [84, 400],'-', c='black')
+    plt.plot([0, 70], [180, 180], '-', c='black')
+    plt.plot([70, 290],[180, 400],'-', c='black')
+    plt.plot([70, 70], [0, 56], '-', c='black')                     #Replace 175.3 with 56 because 100*abs(56-70)/70) = 20% error
+    plt.plot([70, 400], [56, 320],'-', c='black')
+    plt.plot([180, 180], [0, 70], '-', c='black')
+    plt.plot([180, 400], [70, 70], '-', c='black')
+    plt.plot([240, 240], [70, 180],'-', c='black')
+    plt.plot([240, 400], [180, 180], '-', c='black')
+    plt.plot([130, 180], [0, 70], '-', c='black')
+
+    #Add zone titles
+    plt.text(30, 15, "A", fontsize=15)
+    plt.text(370, 260, "B", fontsize=15)
+    plt.text(280, 370, "B", fontsize=15)
+    plt.text(160, 370, "C", fontsize=15)
+    plt.text(160, 15, "C", fontsize=15)
+    plt.text(30, 140, "D", fontsize=15)
+    plt.text(370, 120, "D", fontsize=15)
+    plt.text(30, 370, "E", fontsize=15)
+    plt.text(370, 15, "E", fontsize=15)
+
+    #Statistics from the data
+    zone = zone_counts(ref_values, pred_values)
+
+    return plt, zone
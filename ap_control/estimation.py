@@ -0,0 +1,187 @@
+'''
+Patient parameter estimation from CGM and insulin delivery history.
+
+SYNTAX:
+        params = fit_patient_parameters(BG, doses)
+        params = fit_patient_parameters(BG, doses, initial=params)    # warm start
+
+INPUT:
+        BG                  BGC measurements [mmol/L], shape (patients, ns+1), one every T minutes.
+        doses               Total insulin delivered [U] in each timestep (basal included), shape (patients, ns).
+        mask                Optional boolean array of shape (patients, ns) with the timesteps to fit,
+                            e.g. to leave out meals. The first MAX_TOTAL_ACTIVITY minutes without
+                            a complete insulin history are always left out, so BG must be longer.
+
+Using the convolution form of the MPC glucose prediction, the BGC change over
+one timestep is
+
+    BG(k+1) - BG(k) = -ISF * x_k + ISF * basal_rate * T/60
+
+where x_k is the insulin used during timestep k, i.e. the doses convolved
+with the insulin activity curve. For a given insulin curve this is linear in
+ISF and ISF*basal_rate, and is solved with linear least squares for all
+patients at once. The sums over time that the least squares solution needs
+are precomputed as functions of the insulin curve, so trying another curve
+does not touch the history again. peak_activity and total_activity are fitted with a batched
+compass search on top: every iteration evaluates the 3x3 neighbourhood of
+each patient's current curve, moves to the best one, and halves the step
+size for patients that did not move. Patients drop out of the search once
+both step sizes are below min_step.
+
+Refitting with initial=<previous fit> starts the search from the previous
+curves with the small warm_step sizes. With n_jobs > 1 the patients are split
+into chunks that are fitted in separate processes.
+'''
+
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .insulin import INSULIN_DELAY, PEAK_ACTIVITY, T, TOTAL_ACTIVITY, insulin_effect_curve
+
+
+MIN_TOTAL_ACTIVITY = 90 # [min]
+MAX_TOTAL_ACTIVITY = 480 # [min]
+
+
+class PatientParameters:
+    # Fitted parameters, one entry per patient. sse is the sum of squared residuals
+
+    def __init__(self, ISF, basal_rate, peak_activity, total_activity, sse=None):
+        self.ISF = np.asarray(ISF, dtype=float)
+        self.basal_rate = np.asarray(basal_rate, dtype=float)
+        self.peak_activity = np.asarray(peak_activity, dtype=float)
+        self.total_activity = np.asarray(total_activity, dtype=float)
+        self.sse = None if sse is None else np.asarray(sse, dtype=float)
+
+    def __len__(self):
+        return len(self.ISF)
+
+    def __getitem__(self, idx):
+        return PatientParameters(self.ISF[idx], self.basal_rate[idx], self.peak_activity[idx],
+                                 self.total_activity[idx], None if self.sse is None else self.sse[idx])
+
+    @staticmethod
+    def concatenate(parts):
+        return PatientParameters(*[np.concatenate([getattr(p, name) for p in parts])
+                                   for name in ('ISF', 'basal_rate', 'peak_activity', 'total_activity', 'sse')])
+
+
+def _curve_weights(peak_activity, total_activity, n_lags, T, insulin_delay):
+    # Fraction of a dose used during the timestep that starts lag*T minutes after
+    # injection, lag = 0..n_lags-1, one row per patient
+    used = insulin_effect_curve(n_lags, T, peak_activity[:, None], total_activity[:, None], insulin_delay)
+    return np.diff(used, prepend=0.0, axis=1)
+
+
+def _lagged_moments(doses, dBG, m, n_lags):
+    # The insulin used in timestep k is x_k = sum_l w_l*doses_{k-l}, so the sums
+    # needed for the least squares fit are linear or quadratic in the curve
+    # weights w. The sums over time are computed once per patient here, which
+    # makes evaluating a new insulin curve independent of the number of timesteps.
+    n_patients = doses.shape[0]
+    padded = np.concatenate([np.zeros((n_patients, n_lags - 1)), doses], axis=1)
+    sx = np.empty((n_patients, n_lags))
+    sxy = np.empty((n_patients, n_lags))
+    sxx = np.empty((n_patients, n_lags, n_lags))
+    for p in range(n_patients):
+        D = sliding_window_view(padded[p], n_lags)[:, ::-1]  # D[k, l] = doses[k - l]
+        mD = m[p][:, None]*D
+        sx[p] = mD.sum(axis=0)
+        sxy[p] = dBG[p] @ mD
+        sxx[p] = mD.T @ D
+    n = m.sum(axis=1)
+    sy = (m*dBG).sum(axis=1)
+    syy = (m*dBG**2).sum(axis=1)
+    return n, sy, syy, sx, sxy, sxx
+
+
+def _linear_fit(w, moments):
+    # Weighted least squares of dBG = a*x + c per patient. Returns (a, c, sse)
+    n, sy, syy, sx, sxy, sxx = moments
+    Sx = (w*sx).sum(axis=1)
+    Sxy = (w*sxy).sum(axis=1)
+    Sxx = np.einsum('pl,plm,pm->p', w, sxx, w)
+
+    mx = Sx/n
+    my = sy/n
+    var_x = Sxx - n*mx**2
+    cov_xy = Sxy - n*mx*my
+    a = cov_xy/np.where(var_x > 0, var_x, np.nan)
+    c = my - a*mx
+    sse = syy - n*my**2 - a*cov_xy
+    return a, c, np.where(np.isnan(sse), np.inf, sse)
+
+
+def _fit_chunk(BG, doses, mask, peak, total, peak_step, total_step, n_iter, min_step, T, insulin_delay):
+    dBG = np.diff(BG, axis=1)
+    n_lags = math.ceil(MAX_TOTAL_ACTIVITY/T)
+    m = np.ones(dBG.shape) if mask is None else np.asarray(mask, dtype=float).copy()
+    m[:, :n_lags] = 0  # Incomplete insulin history
+    moments = _lagged_moments(doses, dBG, m, n_lags)
+
+    def evaluate(idx, peak, total):
+        w = _curve_weights(peak, total, n_lags, T, insulin_delay)
+        return _linear_fit(w, [moment[idx] for moment in moments])
+
+    a, c, sse = evaluate(slice(None), peak, total)
+    offsets = [(i, j) for i in (-1, 0, 1) for j in (-1, 0, 1) if (i, j) != (0, 0)]
+    for _ in range(n_iter):
+        # Only search for patients that have not converged yet
+        idx = np.flatnonzero((peak_step >= min_step) | (total_step >= min_step))
+        if len(idx) == 0:
+            break
+        moved = np.zeros(len(idx), dtype=bool)
+        best_peak, best_total = peak[idx], total[idx]
+        for i, j in offsets:
+            new_total = np.clip(total[idx] + j*total_step[idx], MIN_TOTAL_ACTIVITY, MAX_TOTAL_ACTIVITY)
+            new_peak = np.clip(peak[idx] + i*peak_step[idx], insulin_delay + T, new_total - T)
+            new_a, new_c, new_sse = evaluate(idx, new_peak, new_total)
+            better = new_sse < sse[idx]
+            a[idx] = np.where(better, new_a, a[idx])
+            c[idx] = np.where(better, new_c, c[idx])
+            sse[idx] = np.where(better, new_sse, sse[idx])
+            best_peak = np.where(better, new_peak, best_peak)
+            best_total = np.where(better, new_total, best_total)
+            moved |= better
+        peak[idx], total[idx] = best_peak, best_total
+        peak_step[idx] = np.where(moved, peak_step[idx], peak_step[idx]/2)
+        total_step[idx] = np.where(moved, total_step[idx], total_step[idx]/2)
+
+    ISF = -a
+    basal_rate = c*60/(T*ISF)
+    return PatientParameters(ISF, basal_rate, peak, total, sse)
+
+
+def fit_patient_parameters(BG, doses, mask=None, initial=None, T=T, insulin_delay=INSULIN_DELAY, n_iter=20,
+                           step=(15.0, 60.0), warm_step=(5.0, 15.0), min_step=1.0, n_jobs=1, chunk_size=256):
+    BG = np.atleast_2d(np.asarray(BG, dtype=float))
+    doses = np.atleast_2d(np.asarray(doses, dtype=float))
+    assert (BG.shape[1] == doses.shape[1] + 1), "Expected one more BG measurement than doses (BG : {}) (doses : {}).".format(BG.shape[1], doses.shape[1])
+    n_lags = math.ceil(MAX_TOTAL_ACTIVITY/T)
+    assert (BG.shape[1] > n_lags + 2), "Expected more than {} BG measurements, the first {} timesteps have an incomplete insulin history (BG : {}).".format(n_lags + 2, n_lags, BG.shape[1])
+    n_patients = BG.shape[0]
+
+    if initial is None:
+        peak = np.full(n_patients, float(PEAK_ACTIVITY))
+        total = np.full(n_patients, float(TOTAL_ACTIVITY))
+        peak_step, total_step = step
+    else:
+        peak = np.array(initial.peak_activity, dtype=float)
+        total = np.array(initial.total_activity, dtype=float)
+        peak_step, total_step = warm_step
+    peak_step = np.full(n_patients, float(peak_step))
+    total_step = np.full(n_patients, float(total_step))
+
+    args = (n_iter, min_step, T, insulin_delay)
+    if n_jobs == 1 or n_patients <= chunk_size:
+        return _fit_chunk(BG, doses, mask, peak, total, peak_step, total_step, *args)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunks = [slice(i, i + chunk_size) for i in range(0, n_patients, chunk_size)]
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(_fit_chunk, BG[s], doses[s], None if mask is None else mask[s],
+                               peak[s], total[s], peak_step[s], total_step[s], *args) for s in chunks]
+        return PatientParameters.concatenate([f.result() for f in futures])
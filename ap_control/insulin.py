@@ -0,0 +1,147 @@
+'''
+Insulin activity model used by the MPC chapter.
+
+A linear model of insulin activity: no activity before `insulin_delay`, a linear
+rise to the peak at `peak_activity`, and a linear decline to zero at
+`total_activity`. The area under the activity curve is 100 (%), so
+remaining_insulin_effect(t) is the percentage of a dose that is still on board
+t minutes after it was injected.
+
+All functions accept scalars or numpy arrays of time points in minutes.
+IOBTracker keeps track of insulin on board for a running sequence of doses
+with a fixed memory footprint.
+'''
+
+import math
+
+import numpy as np
+
+
+# Static values (same as in the MPC chapter)
+T = 5 # Measurement interval in minutes
+ISF = 2.0 # Insulin sensitivity factor [mmol/L/U]
+BASAL_RATE = 1.0 # [U/hr]
+
+TOTAL_ACTIVITY = 3*60 # Total time of insulin effect in minutes
+PEAK_ACTIVITY = 75 # Time after insulin injection
+INSULIN_DELAY = 10 # Delay for insulin absorption to start
+
+
+def max_activity(total_activity=TOTAL_ACTIVITY, insulin_delay=INSULIN_DELAY):
+    # Height of the activity triangle so that the area under the curve is 100 %
+    return 100*2/(total_activity - insulin_delay)
+
+
+def calc_insulin_activity(t, peak_activity=PEAK_ACTIVITY, total_activity=TOTAL_ACTIVITY, insulin_delay=INSULIN_DELAY):
+    # Returns the percentage of insulin used per minute t minutes after insulin injection
+    t = np.asarray(t, dtype=float)
+    max_val = max_activity(total_activity, insulin_delay)
+
+    rising = (t - insulin_delay)*max_val/(peak_activity - insulin_delay)
+    falling = (total_activity - t)*max_val/(total_activity - peak_activity)
+
+    return np.where(t < insulin_delay, 0.0,
+           np.where(t < peak_activity, rising,
+           np.where(t < total_activity, falling, 0.0)))
+
+
+def remaining_insulin_effect(t, peak_activity=PEAK_ACTIVITY, total_activity=TOTAL_ACTIVITY, insulin_delay=INSULIN_DELAY):
+    # Returns the percentage insulin effect remaining t minutes after insulin injection
+    t = np.asarray(t, dtype=float)
+    max_val = max_activity(total_activity, insulin_delay)
+    activity = calc_insulin_activity(t, peak_activity, total_activity, insulin_delay)
+
+    rising = 100 - (t - insulin_delay)*activity/2
+    falling = 100 - max_val*(peak_activity - insulin_delay)/2 - (t - peak_activity)*(activity + (max_val - activity)/2)
+
+    return np.where(t < insulin_delay, 100.0,
+           np.where(t < peak_activity, rising,
+           np.where(t < total_activity, falling, 0.0)))
+
+
+def insulin_effect_curve(n, T=T, peak_activity=PEAK_ACTIVITY, total_activity=TOTAL_ACTIVITY, insulin_delay=INSULIN_DELAY):
+    # Fraction of a dose that has been used i*T minutes after injection, i = 1..n.
+    # This is the sum of the IOB(i*T) - IOB(i*T - T) terms in the prediction formula
+    t = T*np.arange(1, n + 1)
+    return (100 - remaining_insulin_effect(t, peak_activity, total_activity, insulin_delay))/100
+
+
+def insulin_on_board(doses, T=T, peak_activity=PEAK_ACTIVITY, total_activity=TOTAL_ACTIVITY, insulin_delay=INSULIN_DELAY):
+    # Insulin on board [U] now, given past doses ordered oldest first with the
+    # most recent dose injected T minutes ago
+    doses = np.asarray(doses, dtype=float)
+    n = doses.shape[-1]
+    t = T*np.arange(n, 0, -1)
+    return doses @ (remaining_insulin_effect(t, peak_activity, total_activity, insulin_delay)/100)
+
+
+class IOBTracker:
+    # Insulin on board of a sequence of doses, one dose per timestep of T minutes.
+    #
+    # Instead of recomputing the remaining insulin effect of every past dose, the
+    # tracker keeps the insulin [U] that will be used in each of the next
+    # n_slots timesteps. A dose adds dose*deltas to these slots, where deltas[i]
+    # is (IOB(i*T) - IOB(i*T + T))/100 of a unit dose, and step() consumes the
+    # first slot. The slots are a ring buffer, so nothing is allocated or moved
+    # per timestep, and every slot is reset when it is consumed, so rounding
+    # errors do not accumulate over time.
+    #
+    # The doses of the last n_slots timesteps are kept as well, only for
+    # check_consistency() against the closed form remaining_insulin_effect.
+
+    def __init__(self, T=T, peak_activity=PEAK_ACTIVITY, total_activity=TOTAL_ACTIVITY, insulin_delay=INSULIN_DELAY):
+        self.T = T
+        self.n_slots = math.ceil(total_activity/T)
+        iob = remaining_insulin_effect(T*np.arange(self.n_slots + 1), peak_activity, total_activity, insulin_delay)/100
+        self.deltas = iob[:-1] - iob[1:]
+        self._remaining = iob[:-1] # Closed form IOB of a unit dose, by age in timesteps
+        self._future = np.zeros(self.n_slots)
+        self._doses = np.zeros(self.n_slots)
+        self._scratch = np.zeros(self.n_slots)
+        self._head = 0
+
+    def reset(self):
+        self._future[:] = 0
+        self._doses[:] = 0
+        self._head = 0
+
+    def add(self, dose):
+        # Inject `dose` [U] in the current timestep
+        n = self.n_slots - self._head
+        np.multiply(self.deltas, dose, out=self._scratch)
+        self._future[self._head:] += self._scratch[:n]
+        self._future[:self._head] += self._scratch[n:]
+        self._doses[self._head] += dose
+
+    def step(self):
+        # Move to the next timestep. Returns the insulin [U] used during the timestep
+        used = self._future[self._head]
+        self._future[self._head] = 0
+        self._head = (self._head + 1) % self.n_slots
+        self._doses[self._head] = 0
+        return float(used)
+
+    def iob(self):
+        # Insulin on board [U]
+        return float(self._future.sum())
+
+    def used(self, out):
+        # Fill out[k-1] with the insulin [U] used from now until k*T minutes from
+        # now, k = 1..len(out), by the doses given so far
+        horizon = len(out)
+        first = min(horizon, self.n_slots - self._head)
+        np.cumsum(self._future[self._head:self._head + first], out=out[:first])
+        if horizon > first:
+            second = min(horizon - first, self._head)
+            np.cumsum(self._future[:second], out=out[first:first + second])
+            out[first:first + second] += out[first - 1]
+            out[first + second:] = out[first + second - 1]
+        return out
+
+    def check_consistency(self, atol=1e-9):
+        # Compare the tracked IOB with the closed form IOB of the tracked doses
+        age = (self._head - np.arange(self.n_slots)) % self.n_slots
+        closed_form = float(self._doses[age] @ self._remaining)
+        error = abs(self.iob() - closed_form)
+        assert (error <= atol), "Tracked IOB {} differs from closed form IOB {} by {}.".format(self.iob(), closed_form, error)
+        return error
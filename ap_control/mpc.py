@@ -0,0 +1,179 @@
+'''
+MPC controller from the MPC chapter.
+
+The predicted BGC k timesteps after the referenced BGC measurement is
+
+    BG(k*T) = BG_ref - ISF * sum_j dose_j * (used_j(k*T) - used_j(0))
+
+where used_j(t) is the fraction of dose j that has been used t minutes after
+the reference time (100 - IOB)/100. The doses are insulin injected on top of
+the basal rate, which is assumed to keep glucose levels stable.
+
+For each timestep the controller evaluates every candidate dose in
+range(0, max_insulin, insulin_increment) for the current timestep, picks the
+one that minimizes the squared error to the target over the prediction
+horizon, and injects it (see the "Minimize objective function" algorithm).
+The squared error is convex in the dose, so when SafetyConstraints are given
+the chosen dose is clipped to the constraint bounds afterwards.
+
+The controller keeps the effect of past doses in an IOBTracker, so a step
+costs O(horizon) for the prediction and does not grow the history.
+'''
+
+import math
+
+import numpy as np
+
+from .insulin import INSULIN_DELAY, ISF, PEAK_ACTIVITY, T, TOTAL_ACTIVITY, IOBTracker, insulin_effect_curve
+from .profiling import NULL_PROFILER
+
+
+TARGET = 6.0 # Target BGC [mmol/L]
+HORIZON = 36 # Prediction horizon in timesteps (3 hours with T = 5)
+MAX_INSULIN = 5.0 # [U]
+INSULIN_INCREMENT = 0.05 # [U]
+
+
+def n_effective_doses(T=T, total_activity=TOTAL_ACTIVITY):
+    # Number of past doses (including the current one) that still have an effect
+    return math.ceil(total_activity/T)
+
+
+def effect_matrix(n_doses, horizon, T=T, peak_activity=PEAK_ACTIVITY, total_activity=TOTAL_ACTIVITY, insulin_delay=INSULIN_DELAY):
+    # E[j, k-1] is the fraction of dose j used between the reference time and k*T
+    # minutes later. Doses are ordered oldest first and the last dose is injected
+    # at the reference time.
+    used = np.concatenate(([0.0], insulin_effect_curve(n_doses - 1 + horizon, T, peak_activity, total_activity, insulin_delay)))
+    age = np.arange(n_doses - 1, -1, -1)[:, None]
+    k = np.arange(1, horizon + 1)[None, :]
+    return used[age + k] - used[age]
+
+
+def predict_glucose(BG_ref, doses, horizon=HORIZON, ISF=ISF, T=T, peak_activity=PEAK_ACTIVITY, total_activity=TOTAL_ACTIVITY, insulin_delay=INSULIN_DELAY):
+    # Predicted BGC at T, 2T, ..., horizon*T minutes after BG_ref was measured.
+    # doses is ordered oldest first, one dose per timestep, with the last dose
+    # injected at the reference time. Leading dimensions are batch dimensions.
+    doses = np.asarray(doses, dtype=float)
+    E = effect_matrix(doses.shape[-1], horizon, T, peak_activity, total_activity, insulin_delay)
+    return np.asarray(BG_ref, dtype=float)[..., None] - ISF*(doses @ E)
+
+
+class MPCController:
+    # Receding horizon controller. Call step() with each new glucose measurement,
+    # taken T minutes after the previous one. Returns the dose [U] to inject.
+
+    def __init__(self, target=TARGET, ISF=ISF, T=T, horizon=HORIZON, max_insulin=MAX_INSULIN,
+                 insulin_increment=INSULIN_INCREMENT, peak_activity=PEAK_ACTIVITY,
+                 total_activity=TOTAL_ACTIVITY, insulin_delay=INSULIN_DELAY, constraints=None, profiler=None):
+        self.target = target
+        self.ISF = ISF
+        self.T = T
+        self.horizon = horizon
+        self.constraints = constraints
+        self.profiler = profiler or NULL_PROFILER
+
+        self.insulin_increment = insulin_increment
+        self.candidates = np.arange(0, max_insulin, insulin_increment)
+        self.iob_tracker = IOBTracker(T, peak_activity, total_activity, insulin_delay)
+        self.last_dose = 0.0
+
+        # Insulin used by a unit dose injected now, and the corresponding BGC drop for every candidate dose
+        self.curve = np.concatenate((np.cumsum(self.iob_tracker.deltas), np.ones(horizon)))[:horizon]
+        self._candidate_effect = self.ISF*self.candidates[:, None]*self.curve[None, :]
+
+        # Work arrays for step()
+        self._baseline = np.zeros(horizon)
+        self._predictions = np.zeros(self._candidate_effect.shape)
+        self._total_error = np.zeros(len(self.candidates))
+
+    def reset(self):
+        self.iob_tracker.reset()
+        self.last_dose = 0.0
+
+    def iob(self):
+        # Insulin on board [U] from the doses given so far
+        return self.iob_tracker.iob()
+
+    def predict(self, BG_ref, dose=0.0):
+        # Predicted BGC over the horizon if `dose` is injected now, on top of the doses given so far
+        used = self.iob_tracker.used(np.zeros(self.horizon))
+        return BG_ref - self.ISF*(used + dose*self.curve)
+
+    def step(self, BG_ref):
+        profiler = self.profiler
+
+        with profiler.stage('predict'):
+            # Move to the next timestep
+            self.iob_tracker.step()
+            baseline = self.iob_tracker.used(self._baseline)
+            baseline *= -self.ISF
+            baseline += BG_ref
+
+        with profiler.stage('optimize'):
+            predictions = np.subtract(baseline - self.target, self._candidate_effect, out=self._predictions)
+            np.square(predictions, out=predictions)
+            total_error = predictions.sum(axis=1, out=self._total_error)
+            dose = float(self.candidates[np.argmin(total_error)])
+            profiler.count('optimizer_iterations', len(self.candidates))
+
+        if self.constraints is not None:
+            with profiler.stage('safety'):
+                dose = self.constraints.apply(dose, self.last_dose, self.iob(), baseline.min(), self.T, profiler=profiler)
+
+        self.iob_tracker.add(dose)
+        self.last_dose = dose
+        return dose
+
+
+def step_batch(controllers, BG_refs, profiler=None):
+    # Same as calling step() on each controller with its BG_ref, with the
+    # optimization vectorized over the controllers. The squared error is a
+    # quadratic in the dose, |deviation - dose*effect|^2, so instead of
+    # evaluating every candidate the best candidate is the one closest to the
+    # minimum at dose = deviation.effect/effect.effect. The profiler counts one
+    # 'batch_optimizations' per controller, instead of the candidates counted
+    # as 'optimizer_iterations' by step().
+    profiler = profiler or NULL_PROFILER
+    n = len(controllers)
+    horizon = max(controller.horizon for controller in controllers)
+
+    with profiler.stage('predict'):
+        deviation = np.zeros((n, horizon))
+        effect = np.zeros((n, horizon))
+        predicted_min = np.zeros(n)
+        for i, controller in enumerate(controllers):
+            controller.iob_tracker.step()
+            baseline = controller.iob_tracker.used(controller._baseline)
+            baseline *= -controller.ISF
+            baseline += BG_refs[i]
+            deviation[i, :controller.horizon] = baseline - controller.target
+            effect[i, :controller.horizon] = controller.ISF*controller.curve
+            predicted_min[i] = baseline.min()
+
+    with profiler.stage('optimize'):
+        ee = (effect*effect).sum(axis=1)
+        de = (deviation*effect).sum(axis=1)
+        best = np.divide(de, ee, out=np.zeros(n), where=ee > 0)
+        increment = np.array([controller.insulin_increment for controller in controllers])
+        n_candidates = np.array([len(controller.candidates) for controller in controllers])
+        idx = np.clip(np.round(best/increment), 0, n_candidates - 1).astype(int)
+        doses = np.array([controller.candidates[i] for controller, i in zip(controllers, idx)])
+        profiler.count('batch_optimizations', n)
+
+    constraints = controllers[0].constraints
+    if constraints is not None or any(controller.constraints is not None for controller in controllers):
+        with profiler.stage('safety'):
+            last_dose = np.array([controller.last_dose for controller in controllers])
+            iob = np.array([controller.iob() for controller in controllers])
+            if all(controller.constraints is constraints for controller in controllers):
+                doses = constraints.apply(doses, last_dose, iob, predicted_min, controllers[0].T, profiler=profiler)
+            else:
+                for i, controller in enumerate(controllers):
+                    if controller.constraints is not None:
+                        doses[i] = controller.constraints.apply(doses[i], last_dose[i], iob[i], predicted_min[i],
+                                                                controller.T, profiler=profiler)
+
+    for controller, dose in zip(controllers, doses):
+        controller.iob_tracker.add(dose)
+        controller.last_dose = float(dose)
+    return doses
@@ -0,0 +1,175 @@
+'''
+PI(D) controller from the PID chapter.
+
+calc_response runs the controller over a precomputed array of glucose
+measurements, exactly like the notebook. By default it returns (pv, op), and
+only the recorded values named in `traces` are stored, optionally in a
+smaller dtype such as np.float32. PIDController does the same
+computation one measurement at a time, for use in a closed loop.
+
+The controller output (op) is the insulin delivery rate [U/hr]:
+
+    u(t) = u_bias + Kc*e(t) + Kc/tauI * integral(e) - Kc*tauD * d(PV)/dt
+
+with e(t) = SP - PV and u_bias = basal rate. The output is clamped to
+[op_lo, op_hi], and the integral is not accumulated while clamped
+(anti-reset windup).
+
+PIDController optionally takes SafetyConstraints, which are applied in
+rate units after the op_hi/op_lo clamp. Insulin on board is tracked from the
+delivery above the basal rate, and the predicted low for suspension is a
+linear extrapolation of the glucose trend SUSPEND_LOOKAHEAD minutes ahead.
+'''
+
+import numpy as np
+
+from .insulin import BASAL_RATE, ISF, TOTAL_ACTIVITY, IOBTracker
+from .profiling import NULL_PROFILER
+
+
+SP = 6.0 # Set point [mmol/L]
+KC = -1/ISF
+TAU_I = 10.0
+
+# Upper and Lower limits on OP
+OP_HI = 10.0
+OP_LO = 0.0
+
+# Values recorded by calc_response
+TRACES = ('pv', 'op', 'e', 'ie', 'dpv', 'P', 'I')
+
+SUSPEND_LOOKAHEAD = 30 # Minutes to extrapolate the glucose trend for suspend-on-predicted-low
+
+
+def calc_response(t, Kc, tauI, sp, pv, basal_rate=BASAL_RATE, op_hi=OP_HI, op_lo=OP_LO, traces=('pv', 'op'),
+                  dtype=np.float64, profiler=None):
+    # t = time points
+    # pv = glucose measurements at the time points
+    # traces = names of the recorded values to return, see TRACES. Only these
+    #          are stored, with the given dtype
+    for name in traces:
+        assert (name in TRACES), "Unknown trace {}, expected one of {}.".format(name, TRACES)
+    # specify number of steps
+    ns = len(t)-1
+    profiler = profiler or NULL_PROFILER
+
+    delta_t = t[1]-t[0]
+
+    # storage for recording values
+    stored = {name: np.zeros(ns+1, dtype=dtype) for name in traces if name != 'pv'}
+    if 'pv' in traces:
+        stored['pv'] = np.array(pv, dtype=dtype)  # process variable
+    op = stored.get('op')    # controller output
+    e = stored.get('e')      # error
+    ie = stored.get('ie')    # integral of the error
+    dpv = stored.get('dpv')  # derivative of the pv
+    P = stored.get('P')      # proportional
+    I = stored.get('I')      # integral
+
+    # current values. pv is read one element at a time, so a float32 or memmap
+    # pv is not copied
+    ie_i = 0.0
+    op_i = P_i = I_i = 0.0
+    pv_prev = 0.0
+
+    # loop through time steps
+    with profiler.stage('calc_response'):
+        for i in range(0,ns):
+            pv_i = float(pv[i])
+            e_i = sp[i] - pv_i
+            dpv_i = 0.0
+            if i >= 1:  # calculate starting on second cycle
+                dpv_i = (pv_i-pv_prev)/delta_t
+                ie_i = ie_i + e_i * delta_t
+            pv_prev = pv_i
+            P_i = Kc * e_i
+            I_i = Kc/tauI * ie_i
+            op_i = basal_rate + P_i + I_i
+            if op_i > op_hi:  # check upper limit
+                op_i = op_hi
+                ie_i = ie_i - e_i * delta_t # anti-reset windup
+                profiler.count('clamp_hi')
+                profiler.count('anti_windup')
+            if op_i < op_lo:  # check lower limit
+                op_i = op_lo
+                ie_i = ie_i - e_i * delta_t # anti-reset windup
+                profiler.count('clamp_lo')
+                profiler.count('anti_windup')
+
+            if op is not None: op[i] = op_i
+            if e is not None: e[i] = e_i
+            if ie is not None: ie[i] = ie_i
+            if dpv is not None: dpv[i] = dpv_i
+            if P is not None: P[i] = P_i
+            if I is not None: I[i] = I_i
+        if op is not None: op[ns] = op_i
+        if ie is not None: ie[ns] = ie_i
+        if P is not None: P[ns] = P_i
+        if I is not None: I[ns] = I_i
+    return tuple(stored[name] for name in traces)
+
+
+class PIDController:
+    # Step-wise PID controller. Call step() with each new glucose measurement
+    # taken delta_t minutes after the previous one.
+
+    def __init__(self, Kc=KC, tauI=TAU_I, tauD=0.0, sp=SP, delta_t=1.0, basal_rate=BASAL_RATE,
+                 op_hi=OP_HI, op_lo=OP_LO, constraints=None, total_activity=TOTAL_ACTIVITY, profiler=None):
+        self.Kc = Kc
+        self.tauI = tauI
+        self.tauD = tauD
+        self.sp = sp
+        self.delta_t = delta_t
+        self.basal_rate = basal_rate
+        self.op_hi = op_hi
+        self.op_lo = op_lo
+        self.constraints = constraints
+        self.profiler = profiler or NULL_PROFILER
+
+        # Insulin on board from the delivery above the basal rate
+        self.iob_tracker = IOBTracker(delta_t, total_activity=total_activity)
+        self.reset()
+
+    def reset(self):
+        self.ie = 0.0
+        self.last_pv = None
+        self.op = self.basal_rate
+        self.iob_tracker.reset()
+
+    def iob(self):
+        # Insulin on board [U] from delivery above the basal rate
+        return self.iob_tracker.iob()
+
+    def step(self, pv):
+        profiler = self.profiler
+        with profiler.stage('control'):
+            e = self.sp - pv
+            dpv = 0.0
+            if self.last_pv is not None:  # calculate starting on second cycle
+                dpv = (pv - self.last_pv)/self.delta_t
+                self.ie += e*self.delta_t
+            op = self.basal_rate + self.Kc*e + self.Kc/self.tauI*self.ie - self.Kc*self.tauD*dpv
+
+        with profiler.stage('safety'):
+            self.iob_tracker.step()
+            limited = op
+            if op > self.op_hi:  # check upper limit
+                limited = self.op_hi
+                profiler.count('clamp_hi')
+            elif op < self.op_lo:  # check lower limit
+                limited = self.op_lo
+                profiler.count('clamp_lo')
+            if self.constraints is not None:
+                predicted_min = min(pv, pv + dpv*SUSPEND_LOOKAHEAD)
+                limited = self.constraints.apply(limited, self.op, self.iob(), predicted_min, self.delta_t,
+                                                 rate=True, basal_rate=self.basal_rate, profiler=profiler)
+            if limited != op:
+                self.ie -= e*self.delta_t # anti-reset windup, also on the first cycle like calc_response
+                profiler.count('anti_windup')
+            op = limited
+
+            self.iob_tracker.add((op - self.basal_rate)*self.delta_t/60)
+
+        self.last_pv = pv
+        self.op = op
+        return op
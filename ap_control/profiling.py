@@ -0,0 +1,163 @@
+'''
+Opt-in latency instrumentation for the controllers.
+
+SYNTAX:
+        profiler = ControllerProfiler()
+        controller = MPCController(profiler=profiler)
+        ...
+        snapshot = profiler.snapshot()
+
+Each controller step is split into named stages (e.g. "predict", "optimize",
+"safety") that are timed with time.perf_counter. The most recent
+`max_samples` durations of each stage are kept in a fixed size ring buffer,
+from which p50/p99/max are computed when a snapshot is taken. Counters are
+plain integers (optimizer iterations, clamp and anti-windup events, ...).
+
+Controllers that are not given a profiler use NULL_PROFILER, whose stage()
+returns a shared no-op context manager, so the disabled path costs one
+attribute lookup and an empty with-block per stage.
+
+Every stage() call returns a new timer, and recording is guarded by a lock,
+so one profiler can be shared by nested stages and by several threads.
+
+snapshot() returns a plain dict with only builtin types, so it can be passed
+directly to json.dumps for monitoring. Profilers can be pickled with the
+controllers that use them, keeping the samples recorded so far.
+'''
+
+import json
+import threading
+import time
+
+import numpy as np
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class NullProfiler:
+    # Profiler that records nothing. Used when instrumentation is disabled.
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def record(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def snapshot(self):
+        return {'stages': {}, 'counters': {}}
+
+    def reset(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class _Stage:
+    __slots__ = ('_profiler', '_name', '_start')
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._profiler.record(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class _StageStats:
+    __slots__ = ('samples', 'n', 'total', 'max')
+
+    def __init__(self, max_samples):
+        self.samples = np.zeros(max_samples)
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class ControllerProfiler:
+    # Per-stage timers and event counters for controller steps.
+    enabled = True
+
+    def __init__(self, max_samples=4096):
+        self.max_samples = max_samples
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # The lock cannot be pickled, e.g. when a profiled controller is checkpointed
+        with self._lock:
+            state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        # Context manager timing one execution of the stage `name`. A new one is
+        # returned every time, so stages can be nested and used from several threads
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                stats = self._stages[name] = _StageStats(self.max_samples)
+            stats.samples[stats.n % self.max_samples] = seconds
+            stats.n += 1
+            stats.total += seconds
+            if seconds > stats.max:
+                stats.max = seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        stages = {}
+        for name, stats in self._stages.items():
+            samples = stats.samples[:min(stats.n, self.max_samples)]
+            p50, p99 = np.percentile(samples, [50, 99])
+            stages[name] = {
+                'count': stats.n,
+                'mean_ms': 1e3*stats.total/stats.n,
+                'p50_ms': 1e3*float(p50),
+                'p99_ms': 1e3*float(p99),
+                'max_ms': 1e3*stats.max,
+            }
+        return {'stages': stages, 'counters': dict(self._counters)}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
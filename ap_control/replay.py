@@ -0,0 +1,205 @@
+'''
+Replay of recorded patient logs through the controllers.
+
+SYNTAX:
+        replay = run_replay(read_log('patient.csv'), MPCController(), checkpoint_path='patient.ckpt')
+        summary = replay.summary()
+
+        summaries = replay_many({'mpc': ('patient.csv', MPCController()),
+                                 'pid': ('patient.csv', PIDController(delta_t=5))}, n_jobs=2)
+
+A log is a sequence of (timestamp, BG, dose) records in time order, one
+every T minutes, where BG [mmol/L] is nan when there is no measurement and
+dose is the insulin [U] that was actually delivered on top of the basal rate
+in that timestep. read_log streams these from a "timestamp,BG,dose" text file.
+
+For every record the controller makes its decision from the measurement
+(the counterfactual dose), after which its state is set to follow the dose
+that was actually delivered, so that later decisions and predictions are
+made from what actually happened. There are no wall-clock waits.
+
+MPC controllers also predict the BGC over their horizon at every step, and
+the predictions are compared with the measurements once they arrive. The
+summary has the mean absolute error, RMSE and Clarke Error Grid zone counts
+for every prediction horizon.
+
+With checkpoint_path, the replay state (controller included) is pickled
+every checkpoint_every records and when the log ends. A replay that is
+started again with the same checkpoint_path resumes after the last record
+in the checkpoint.
+'''
+
+import math
+import os
+import pickle
+
+import numpy as np
+
+from .clarke import MMOL_TO_MGDL, clarke_zones
+from .mpc import MPCController
+from .pid import PIDController
+
+
+CHECKPOINT_EVERY = 288*7 # One week of records with T = 5
+
+
+def read_log(path):
+    # Stream (timestamp, BG, dose) records from a "timestamp,BG,dose" text file.
+    # Lines that do not start with a number (headers) are skipped
+    with open(path) as f:
+        for line in f:
+            fields = line.strip().split(',')
+            try:
+                yield (float(fields[0]), float(fields[1]) if fields[1] else math.nan, float(fields[2]))
+            except (ValueError, IndexError):
+                continue
+
+
+class Replay:
+    # Replay state of one controller on one log
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.last_timestamp = -math.inf
+
+        self.timestamps = []
+        self.BG = []
+        self.actual = [] # Delivered dose [U] on top of basal
+        self.counterfactual = [] # Controller dose [U] on top of basal
+
+        # Predictions made in the last `horizon` steps, by step number modulo horizon
+        self.horizon = controller.horizon if isinstance(controller, MPCController) else 0
+        self._predictions = np.full((self.horizon, self.horizon), np.nan)
+        self._step = 0
+        self.abs_error = np.zeros(self.horizon)
+        self.squared_error = np.zeros(self.horizon)
+        self.n_predictions = np.zeros(self.horizon, dtype=int)
+        self.zones = np.zeros((self.horizon, 5), dtype=int)
+
+    def _decide(self, BG, dose):
+        # Counterfactual dose [U] on top of basal, after which the controller
+        # follows the actual dose
+        controller = self.controller
+        if isinstance(controller, MPCController):
+            if math.isnan(BG):
+                controller.iob_tracker.step()
+                controller.iob_tracker.add(dose)
+                output = math.nan
+            else:
+                output = controller.step(BG)
+                controller.iob_tracker.add(dose - output)
+            controller.last_dose = dose
+            return output
+
+        if isinstance(controller, PIDController):
+            to_dose = controller.delta_t/60
+            if math.isnan(BG):
+                controller.iob_tracker.step()
+                controller.iob_tracker.add(dose)
+                output = math.nan
+            else:
+                output = (controller.step(BG) - controller.basal_rate)*to_dose
+                controller.iob_tracker.add(dose - output)
+            controller.op = controller.basal_rate + dose/to_dose
+            return output
+
+        return controller.step(BG)
+
+    def _score(self, BG):
+        # Compare the predictions made 1..horizon steps ago with this measurement
+        h = np.arange(1, self.horizon + 1)
+        predicted = self._predictions[(self._step - h) % self.horizon, h - 1]
+        valid = ~np.isnan(predicted)
+        if not valid.any():
+            return
+        error = predicted[valid] - BG
+        self.abs_error[valid] += np.abs(error)
+        self.squared_error[valid] += error**2
+        self.n_predictions[valid] += 1
+        np.add.at(self.zones, (np.flatnonzero(valid), clarke_zones(BG*MMOL_TO_MGDL, predicted[valid]*MMOL_TO_MGDL)), 1)
+
+    def feed(self, timestamp, BG, dose):
+        if self.horizon and not math.isnan(BG):
+            self._score(BG)
+
+        output = self._decide(BG, dose)
+
+        if self.horizon:
+            slot = self._step % self.horizon
+            if math.isnan(BG):
+                self._predictions[slot] = np.nan
+            else:
+                self._predictions[slot] = self.controller.predict(BG)
+
+        self.timestamps.append(timestamp)
+        self.BG.append(BG)
+        self.actual.append(dose)
+        self.counterfactual.append(output)
+        self.last_timestamp = timestamp
+        self._step += 1
+
+    def save(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def summary(self):
+        actual = np.array(self.actual)
+        counterfactual = np.array(self.counterfactual)
+        decided = ~np.isnan(counterfactual)
+        n = np.maximum(self.n_predictions, 1)
+        return {
+            'steps': len(self.actual),
+            'actual_insulin': float(actual.sum()),
+            'counterfactual_insulin': float(counterfactual[decided].sum()),
+            'mean_abs_dose_difference': float(np.abs(counterfactual - actual)[decided].mean()) if decided.any() else math.nan,
+            'horizon_steps': list(range(1, self.horizon + 1)),
+            'mae': np.where(self.n_predictions > 0, self.abs_error/n, np.nan).tolist(),
+            'rmse': np.where(self.n_predictions > 0, np.sqrt(self.squared_error/n), np.nan).tolist(),
+            'clarke_zones': self.zones.tolist(),
+        }
+
+
+def run_replay(log, controller, checkpoint_path=None, checkpoint_every=CHECKPOINT_EVERY):
+    # Replay every record of the log. Resumes from checkpoint_path if it exists
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        replay = Replay.load(checkpoint_path)
+    else:
+        replay = Replay(controller)
+
+    since_checkpoint = 0
+    for timestamp, BG, dose in log:
+        if timestamp <= replay.last_timestamp:
+            continue
+        replay.feed(timestamp, BG, dose)
+        since_checkpoint += 1
+        if checkpoint_path is not None and since_checkpoint >= checkpoint_every:
+            replay.save(checkpoint_path)
+            since_checkpoint = 0
+
+    if checkpoint_path is not None:
+        replay.save(checkpoint_path)
+    return replay
+
+
+def _replay_job(path, controller, checkpoint_path, checkpoint_every):
+    return run_replay(read_log(path), controller, checkpoint_path, checkpoint_every).summary()
+
+
+def replay_many(jobs, n_jobs=None, checkpoint_dir=None, checkpoint_every=CHECKPOINT_EVERY):
+    # Replay {name: (log path, controller)} jobs in parallel processes. Several
+    # jobs may use the same log with different controllers. Returns {name: summary}
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = {}
+        for name, (path, controller) in jobs.items():
+            checkpoint_path = None if checkpoint_dir is None else os.path.join(checkpoint_dir, '{}.ckpt'.format(name))
+            futures[name] = pool.submit(_replay_job, path, controller, checkpoint_path, checkpoint_every)
+        return {name: future.result() for name, future in futures.items()}
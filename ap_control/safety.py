@@ -0,0 +1,144 @@
+'''
+Safety constraints on controller outputs.
+
+SYNTAX:
+        constraints = SafetyConstraints(max_bolus=2.0, max_iob=5.0, suspend_below=3.9)
+        lo, hi = constraints.bounds(previous, iob, predicted_min, horizon)
+        u = constraints.apply(u, previous, iob, predicted_min)
+
+INPUT:
+        previous            Previous controller output, in output units.
+        iob                 Insulin on board [U] from insulin delivered on top of the basal rate.
+        predicted_min       Lowest predicted BGC [mmol/L] over the prediction horizon.
+        horizon             Number of future timesteps to compute bounds for.
+        iob_used            Optional insulin [U] used from now until k*T minutes from now,
+                            k = 1..horizon, by the insulin already on board.
+
+All inputs may be numpy arrays with one entry per patient, and the bounds are
+returned with shape (patients..., horizon). Each constraint is optional:
+
+    max_bolus           Max insulin [U] delivered on top of the basal rate in one timestep
+    max_basal           Max delivery rate [U/hr]. Only applies to rate outputs
+    max_rate_change     Max increase of the output between two timesteps, in output units
+    max_iob             IOB ceiling [U]. Limits each timestep's insulin to max_iob - iob
+    suspend_below       Suspend delivery when the predicted BGC falls below this [mmol/L]
+
+Controller outputs are either doses [U] on top of basal (MPC, rate=False) or
+delivery rates [U/hr] including the basal rate (PID, rate=True). The
+constraints only ever lower insulin delivery: the lower bound is always 0, so
+the rate of change limit only limits increases, and delivery can always be
+reduced or suspended immediately. Over the horizon the bounds are
+cumulative: the rate of change limit allows one max_rate_change per
+timestep, and the IOB ceiling of each timestep leaves room for the
+remaining insulin of every earlier timestep dosing up to its bound, so any
+sequence of outputs within the bounds keeps the IOB below max_iob. Without
+iob_used, the insulin already on board is assumed not to decay, which only
+makes the later bounds lower.
+'''
+
+import numpy as np
+
+from .insulin import T, remaining_insulin_effect
+from .profiling import NULL_PROFILER
+
+
+class SafetyConstraints:
+
+    def __init__(self, max_bolus=None, max_basal=None, max_rate_change=None, max_iob=None, suspend_below=None):
+        self.max_bolus = max_bolus
+        self.max_basal = max_basal
+        self.max_rate_change = max_rate_change
+        self.max_iob = max_iob
+        self.suspend_below = suspend_below
+
+    def bounds(self, previous, iob=0.0, predicted_min=np.inf, horizon=1, T=T, rate=False, basal_rate=0.0, iob_used=None):
+        previous = np.asarray(previous, dtype=float)[..., None]
+        iob = np.asarray(iob, dtype=float)[..., None]
+        predicted_min = np.asarray(predicted_min, dtype=float)[..., None]
+
+        # Conversion from insulin [U] on top of basal in one timestep to output units
+        scale = 60/T if rate else 1.0
+        offset = basal_rate if rate else 0.0
+
+        lo = np.zeros(1)
+        hi = np.full(1, np.inf)
+        if rate and self.max_basal is not None:
+            hi = np.minimum(hi, self.max_basal)
+        if self.max_bolus is not None:
+            hi = np.minimum(hi, offset + self.max_bolus*scale)
+        if self.max_rate_change is not None:
+            steps = self.max_rate_change*np.arange(1, horizon + 1)
+            hi = np.minimum(hi, previous + steps)
+        if self.suspend_below is not None:
+            hi = np.where(predicted_min < self.suspend_below, 0.0, hi)
+
+        shape = np.broadcast_shapes(previous.shape[:-1], iob.shape[:-1], predicted_min.shape[:-1]) + (horizon,)
+        if self.max_iob is not None:
+            hi = self._iob_ceiling(np.broadcast_to(hi, shape).copy(), iob, T, scale, offset, iob_used)
+
+        hi = np.maximum(hi, 0.0)
+        return np.broadcast_to(lo, shape), np.broadcast_to(hi, shape)
+
+    def _iob_ceiling(self, hi, iob, T, scale, offset, iob_used):
+        # Lower hi[..., k] so that the IOB stays below max_iob after the dose of
+        # timestep k, even if every earlier timestep of the horizon doses up to its
+        # own bound. The IOB of the earlier doses decays with the insulin model, and
+        # iob_used[..., k-1] is the insulin used in the first k timesteps by the
+        # insulin already on board (IOBTracker.used), which is 0 if not given
+        horizon = hi.shape[-1]
+        on_board = np.broadcast_to(iob, hi.shape).copy()
+        if iob_used is not None:
+            on_board[..., 1:] -= np.asarray(iob_used, dtype=float)[..., :horizon - 1]
+        remaining = remaining_insulin_effect(T*np.arange(1, horizon))/100
+        for k in range(horizon):
+            hi[..., k] = np.minimum(hi[..., k], offset + np.maximum(self.max_iob - on_board[..., k], 0)*scale)
+            on_board[..., k + 1:] += ((hi[..., k] - offset)/scale)[..., None]*remaining[:horizon - k - 1]
+        return hi
+
+    def _next_bounds(self, previous, iob, predicted_min, T, rate, basal_rate):
+        # Same as bounds() with horizon=1 for a single patient, without numpy overhead
+        scale = 60/T if rate else 1.0
+        offset = basal_rate if rate else 0.0
+
+        lo = 0.0
+        hi = np.inf
+        if rate and self.max_basal is not None:
+            hi = min(hi, self.max_basal)
+        if self.max_bolus is not None:
+            hi = min(hi, offset + self.max_bolus*scale)
+        if self.max_iob is not None:
+            hi = min(hi, offset + max(self.max_iob - iob, 0)*scale)
+        if self.max_rate_change is not None:
+            hi = min(hi, previous + self.max_rate_change)
+        if self.suspend_below is not None and predicted_min < self.suspend_below:
+            hi = 0.0
+
+        hi = max(hi, 0.0)
+        return lo, hi
+
+    def apply(self, u, previous, iob=0.0, predicted_min=np.inf, T=T, rate=False, basal_rate=0.0, profiler=NULL_PROFILER):
+        # Clip the output u to the bounds of the next timestep
+        if np.ndim(u) == 0 and np.ndim(previous) == 0 and np.ndim(iob) == 0 and np.ndim(predicted_min) == 0:
+            lo, hi = self._next_bounds(previous, iob, predicted_min, T, rate, basal_rate)
+            if u > hi:
+                profiler.count('constraint_hi')
+            elif u < lo:
+                profiler.count('constraint_lo')
+            if hi == 0 and self.suspend_below is not None and predicted_min < self.suspend_below:
+                profiler.count('suspend')
+            return float(min(max(u, lo), hi))
+
+        lo, hi = self.bounds(previous, iob, predicted_min, 1, T, rate, basal_rate)
+        lo = lo[..., 0]
+        hi = hi[..., 0]
+        clipped = np.clip(u, lo, hi)
+
+        if profiler.enabled:
+            profiler.count('constraint_hi', int(np.count_nonzero(u > hi)))
+            profiler.count('constraint_lo', int(np.count_nonzero(u < lo)))
+            if self.suspend_below is not None:
+                profiler.count('suspend', int(np.count_nonzero(np.asarray(predicted_min) < self.suspend_below)))
+
+        if clipped.ndim == 0:
+            return float(clipped)
+        return clipped
@@ -0,0 +1,197 @@
+'''
+Asyncio control service running one controller per patient.
+
+SYNTAX:
+        service = ControlService(lambda patient_id: MPCController(), FileSource('readings.csv'), SimulatedPump())
+        asyncio.run(service.run())
+
+Readings are (patient_id, timestamp, BG) tuples, with the timestamp in
+minutes, received from a source. Each reading makes the step of that
+patient's controller due, and the controller output is sent to the sink as
+(patient_id, timestamp, output). The output is a dose [U] for MPC
+controllers and a delivery rate [U/hr] for PID controllers.
+
+Sources implement an async generator readings(), and sinks an async
+deliver(patient_id, timestamp, output) method:
+
+    FileSource          Text file with one "patient_id,timestamp,BG" line per reading
+    SocketSource        TCP server receiving "patient_id,timestamp,BG" lines
+    SimulatedPump       Records the delivered outputs per patient
+
+Readings are put on a queue of at most max_pending readings, so a source is
+paused while the controllers are behind (backpressure). The steps that are due
+are taken from the queue in batches of at most max_batch readings and run in a
+worker thread, with the MPC optimization vectorized over the batch
+(mpc.step_batch). A patient is stepped at most once per batch: a batch ends
+at the next reading of a patient that is already in it, so readings are
+always handled in the order they were received, and at most one reading is
+held outside the queue. If the source raises, the readings received before
+the error are still handled, after which run() raises the error.
+
+If a profiler is given, the stages of the batched steps are timed, and
+'latency' records the time from a reading being received until its output
+is delivered.
+'''
+
+import asyncio
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .mpc import MPCController, step_batch
+from .profiling import NULL_PROFILER
+
+
+def parse_reading(line):
+    patient_id, timestamp, BG = line.strip().split(',')
+    return (patient_id, float(timestamp), float(BG))
+
+
+class FileSource:
+    # Readings from a text file with one "patient_id,timestamp,BG" line per reading
+
+    def __init__(self, path):
+        self.path = path
+
+    async def readings(self):
+        with open(self.path) as f:
+            for i, line in enumerate(f):
+                if line.strip():
+                    yield parse_reading(line)
+                if i % 1000 == 0:
+                    await asyncio.sleep(0)
+
+
+class SocketSource:
+    # TCP server receiving "patient_id,timestamp,BG" lines from any number of
+    # connections. start() binds the server, after which port is known.
+
+    def __init__(self, host='127.0.0.1', port=0, max_pending=1000):
+        self.host = host
+        self.port = port
+        self._queue = asyncio.Queue(max_pending)
+        self._server = None
+
+    async def start(self):
+        if self._server is None:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self._queue.put(None)
+
+    async def _handle(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    await self._queue.put(parse_reading(line.decode()))
+        finally:
+            writer.close()
+
+    async def readings(self):
+        await self.start()
+        while (reading := await self._queue.get()) is not None:
+            yield reading
+
+
+class SimulatedPump:
+    # Records the delivered outputs as (timestamp, output) per patient
+
+    def __init__(self):
+        self.deliveries = defaultdict(list)
+
+    async def deliver(self, patient_id, timestamp, output):
+        self.deliveries[patient_id].append((timestamp, output))
+
+
+class ControlService:
+
+    def __init__(self, controller_factory, source, sink, max_pending=10000, max_batch=4096, profiler=None):
+        self.controller_factory = controller_factory
+        self.source = source
+        self.sink = sink
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.profiler = profiler or NULL_PROFILER
+        self.controllers = {}
+
+    def controller(self, patient_id):
+        controller = self.controllers.get(patient_id)
+        if controller is None:
+            controller = self.controllers[patient_id] = self.controller_factory(patient_id)
+        return controller
+
+    def _step(self, readings):
+        # Runs in the worker thread. Returns the controller output for every reading
+        outputs = [None]*len(readings)
+        mpc = []
+        for i, (patient_id, timestamp, BG) in enumerate(readings):
+            controller = self.controller(patient_id)
+            if isinstance(controller, MPCController):
+                mpc.append(i)
+            else:
+                outputs[i] = controller.step(BG)
+        if mpc:
+            doses = step_batch([self.controller(readings[i][0]) for i in mpc], [readings[i][2] for i in mpc], self.profiler)
+            for i, dose in zip(mpc, doses):
+                outputs[i] = float(dose)
+        return outputs
+
+    async def run(self):
+        # Runs until the source has no more readings and every step is done
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(self.max_pending)
+        executor = ThreadPoolExecutor(max_workers=1)
+
+        async def ingest():
+            # The queue is also ended when the source raises, so that the main loop
+            # stops instead of waiting forever. The error is raised by `await ingest_task`
+            try:
+                async for reading in self.source.readings():
+                    await queue.put((reading, time.perf_counter()))
+            except Exception:
+                await queue.put(None)
+                raise
+            await queue.put(None)
+
+        ingest_task = asyncio.create_task(ingest())
+        carry = None # Reading for a patient that was already in the previous batch
+        done = False
+        try:
+            while not done or carry is not None:
+                if carry is not None:
+                    item, carry = carry, None
+                else:
+                    item = await queue.get()
+                if item is None:
+                    done = True
+                    continue
+                batch = [item]
+                patients = {item[0][0]}
+
+                # Take the readings that are already queued, up to the next reading
+                # of a patient that is already in the batch, which starts the next batch
+                while len(batch) < self.max_batch and not queue.empty():
+                    item = queue.get_nowait()
+                    if item is None:
+                        done = True
+                        break
+                    if item[0][0] in patients:
+                        carry = item
+                        break
+                    batch.append(item)
+                    patients.add(item[0][0])
+
+                readings = [reading for reading, _ in batch]
+                outputs = await loop.run_in_executor(executor, self._step, readings)
+                for (reading, received), output in zip(batch, outputs):
+                    await self.sink.deliver(reading[0], reading[1], output)
+                    self.profiler.record('latency', time.perf_counter() - received)
+                self.profiler.count('batches')
+            await ingest_task
+        finally:
+            ingest_task.cancel()
+            executor.shutdown(wait=False)
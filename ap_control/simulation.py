@@ -0,0 +1,210 @@
+'''
+Vectorized simulation of controllers on a cohort of simulated patients.
+
+The patients follow the same model as the MPC glucose prediction: insulin
+delivered on top of the basal rate lowers the BGC by ISF per unit, following
+the insulin activity curve, while a per-patient disturbance (meals, basal
+mismatch, ...) is added to the BGC every timestep:
+
+    BG((k+1)*T) = BG(k*T) + disturbance_k - ISF * (insulin used between k*T and (k+1)*T)
+
+State arrays have shape (candidates, patients), so that several controller
+tunings can be simulated on the same cohort at once. Patient parameters have
+shape (patients,) and controller parameters shape (candidates, 1).
+
+For large sweeps, random_cohort can write the disturbance to a memmap, and
+simulate_pid can store only some traces, in float32, and write them to
+memmaps one chunk of patients at a time. The simulation state itself is
+always float64.
+'''
+
+import os
+
+import numpy as np
+
+from .insulin import INSULIN_DELAY, PEAK_ACTIVITY, T, TOTAL_ACTIVITY, insulin_effect_curve
+from .mpc import n_effective_doses
+from .pid import OP_HI, OP_LO, SP
+
+
+class Cohort:
+    # Simulated patients. disturbance has shape (patients, timesteps) in mmol/L
+    # per timestep, and is kept in the dtype it is given in (e.g. a float32 memmap)
+
+    def __init__(self, ISF, basal_rate, BG_0, disturbance, T=T):
+        self.ISF = np.asarray(ISF, dtype=float)
+        self.basal_rate = np.asarray(basal_rate, dtype=float)
+        self.BG_0 = np.asarray(BG_0, dtype=float)
+        self.disturbance = disturbance if isinstance(disturbance, np.ndarray) and disturbance.dtype.kind == 'f' \
+            else np.asarray(disturbance, dtype=float)
+        self.T = T
+
+    @property
+    def n_patients(self):
+        return self.disturbance.shape[0]
+
+    @property
+    def ns(self):
+        return self.disturbance.shape[1]
+
+    def take(self, idx):
+        # Cohort with only the patients in idx
+        return Cohort(self.ISF[idx], self.basal_rate[idx], self.BG_0[idx], self.disturbance[idx], self.T)
+
+
+def random_cohort(n_patients, days=1, T=T, seed=None, dtype=np.float64, path=None, chunk_size=1024):
+    # Patients with random ISF, basal rate and starting BGC, eating three meals a
+    # day and with a slow drift from a mismatch between true and programmed basal.
+    # With path, the disturbance is written chunk_size patients at a time to a
+    # .npy file and returned as a memmap
+    rng = np.random.default_rng(seed)
+    ns = int(days*24*60/T)
+    steps_per_day = int(24*60/T)
+
+    ISF = rng.uniform(1.0, 4.0, n_patients)
+    basal_rate = rng.uniform(0.5, 1.5, n_patients)
+    BG_0 = rng.uniform(5.0, 12.0, n_patients)
+
+    # Basal mismatch of up to +-20 %, as a glucose drift per timestep
+    drift = rng.uniform(-0.2, 0.2, n_patients)*basal_rate*ISF*T/60
+
+    # Meals raise the BGC with a triangular profile over two hours
+    absorption = 120//T
+    profile = 1 - np.abs(np.linspace(-1, 1, absorption))
+    profile /= profile.sum()
+    meal_times = np.array([day*steps_per_day*T + hour*60 for day in range(days) for hour in (8, 12, 18)])
+    meal_start = (meal_times[None, :] + rng.integers(-30, 31, (n_patients, len(meal_times))))//T
+    meal_rise = rng.uniform(2.0, 6.0, (n_patients, len(meal_times)))
+
+    if path is None:
+        disturbance = np.zeros((n_patients, ns), dtype=dtype)
+    else:
+        disturbance = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(n_patients, ns))
+
+    for start in range(0, n_patients, chunk_size):
+        rows = slice(start, min(start + chunk_size, n_patients))
+        chunk = np.repeat(drift[rows, None], ns, axis=1)
+        n = chunk.shape[0]
+        for meal in range(len(meal_times)):
+            steps = meal_start[rows, meal, None] + np.arange(absorption)
+            valid = steps < ns
+            patient = np.broadcast_to(np.arange(n)[:, None], steps.shape)
+            chunk[patient[valid], steps[valid]] += (meal_rise[rows, meal, None]*profile)[valid]
+        disturbance[rows] = chunk
+
+    if path is not None:
+        disturbance.flush()
+    return Cohort(ISF, basal_rate, BG_0, disturbance, T)
+
+
+class BatchPlant:
+    # Glucose response of a cohort to insulin delivery rates [U/hr]
+
+    def __init__(self, cohort, n_candidates=1, peak_activity=PEAK_ACTIVITY, total_activity=TOTAL_ACTIVITY, insulin_delay=INSULIN_DELAY):
+        self.cohort = cohort
+        T = cohort.T
+        n_doses = n_effective_doses(T, total_activity)
+        used = np.concatenate(([0.0], insulin_effect_curve(n_doses, T, peak_activity, total_activity, insulin_delay)))
+        # Fraction of a dose used during the next timestep, oldest dose first
+        self.weights = np.diff(used)[::-1].copy()
+        self.BG = np.repeat(cohort.BG_0[None, :], n_candidates, axis=0)
+        self.doses = np.zeros((n_candidates, cohort.n_patients, n_doses))
+        self.k = 0
+
+    def take(self, idx):
+        # Keep only the candidates in idx
+        self.BG = self.BG[idx]
+        self.doses = self.doses[idx]
+
+    def step(self, op):
+        cohort = self.cohort
+        self.doses[..., :-1] = self.doses[..., 1:]
+        self.doses[..., -1] = (op - cohort.basal_rate)*cohort.T/60
+        self.BG = self.BG + cohort.disturbance[:, self.k] - cohort.ISF*(self.doses @ self.weights)
+        self.k += 1
+        return self.BG
+
+
+class BatchPID:
+    # PI controller from calc_response, vectorized over candidates and patients
+
+    def __init__(self, Kc, tauI, cohort, sp=SP, op_hi=OP_HI, op_lo=OP_LO):
+        self.Kc = np.asarray(Kc, dtype=float).reshape(-1, 1)
+        self.tauI = np.asarray(tauI, dtype=float).reshape(-1, 1)
+        self.basal_rate = cohort.basal_rate
+        self.delta_t = cohort.T
+        self.sp = sp
+        self.op_hi = op_hi
+        self.op_lo = op_lo
+        self.ie = np.zeros((len(self.Kc), cohort.n_patients))
+        self.first = True
+
+    def take(self, idx):
+        self.Kc = self.Kc[idx]
+        self.tauI = self.tauI[idx]
+        self.ie = self.ie[idx]
+
+    def step(self, pv):
+        e = self.sp - pv
+        if not self.first:  # calculate starting on second cycle
+            self.ie += e*self.delta_t
+        op = self.basal_rate + self.Kc*e + self.Kc/self.tauI*self.ie
+        # anti-reset windup, also on the first cycle like calc_response
+        clamped = (op > self.op_hi) | (op < self.op_lo)
+        self.ie -= np.where(clamped, e*self.delta_t, 0.0)
+        self.first = False
+        return np.clip(op, self.op_lo, self.op_hi)
+
+
+SIMULATION_TRACES = ('pv', 'op')
+
+
+def simulate_pid(Kc, tauI, cohort, sp=SP, op_hi=OP_HI, op_lo=OP_LO, traces=SIMULATION_TRACES, dtype=np.float64,
+                 chunk_size=None, out_dir=None):
+    # Closed loop simulation of every (Kc, tauI) pair on every patient.
+    # Returns the traces named in `traces` ('pv' and/or 'op', default (pv, op))
+    # with shape (candidates, patients, ns+1), stored in the given dtype.
+    #
+    # Patients are simulated chunk_size at a time, so the working memory is about
+    # candidates*chunk_size*(ns+1) values per trace. With out_dir, every trace is
+    # a memmap of the file out_dir/<name>.npy that each chunk is written to when
+    # it is done, and chunk_size defaults to 1024 patients. Without out_dir the
+    # whole output is in memory anyway, and all patients are simulated at once.
+    for name in traces:
+        assert (name in SIMULATION_TRACES), "Unknown trace {}, expected one of {}.".format(name, SIMULATION_TRACES)
+    n_candidates = np.size(Kc)
+    shape = (n_candidates, cohort.n_patients, cohort.ns + 1)
+    chunk_size = chunk_size or (cohort.n_patients if out_dir is None else 1024)
+
+    if out_dir is None:
+        out = {name: np.zeros(shape, dtype=dtype) for name in traces}
+    else:
+        out = {name: np.lib.format.open_memmap(os.path.join(out_dir, name + '.npy'), mode='w+', dtype=dtype, shape=shape)
+               for name in traces}
+
+    for start in range(0, cohort.n_patients, chunk_size):
+        rows = slice(start, min(start + chunk_size, cohort.n_patients))
+        patients = cohort.take(rows)
+        plant = BatchPlant(patients, n_candidates)
+        controller = BatchPID(Kc, tauI, patients, sp, op_hi, op_lo)
+
+        # Chunks are filled in memory and written to the output in one go
+        chunk = {name: np.zeros(plant.BG.shape + (cohort.ns + 1,), dtype=dtype) for name in traces}
+        pv_chunk = chunk.get('pv')
+        op_chunk = chunk.get('op')
+
+        pv = plant.BG
+        if pv_chunk is not None: pv_chunk[..., 0] = pv
+        for i in range(cohort.ns):
+            op = controller.step(pv)
+            pv = plant.step(op)
+            if op_chunk is not None: op_chunk[..., i] = op
+            if pv_chunk is not None: pv_chunk[..., i + 1] = pv
+        if op_chunk is not None: op_chunk[..., -1] = op
+
+        for name in traces:
+            out[name][:, rows] = chunk[name]
+            if out_dir is not None:
+                out[name].flush()
+
+    return tuple(out[name] for name in traces)
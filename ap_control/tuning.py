@@ -0,0 +1,83 @@
+'''
+Automatic PID gain tuning.
+
+SYNTAX:
+        Kc, tauI, costs = tune_pid(cohort)
+
+Every candidate (Kc, tauI) pair is simulated in closed loop on a cohort of
+simulated patients, and the pair with the lowest mean cost is returned. The
+cost of a patient is the ITAE (Integral of Time-weighted Absolute Error, with
+time in hours) plus a penalty for time spent below the hypoglycemia threshold:
+
+    cost = sum(t*|SP - PV|*dt) + hypo_weight*sum(max(hypo_threshold - PV, 0)*dt)
+
+Candidates are simulated together in batches of batch_size. Both terms only
+grow with time, so every checkpoint_steps timesteps candidates whose partial
+cost already exceeds the best complete cost are dropped. Candidates whose
+partial cost is more than prune_ratio times the best partial cost in the
+batch are also dropped as clearly bad. Dropped candidates get cost nan.
+'''
+
+import numpy as np
+
+from .insulin import ISF
+from .pid import OP_HI, OP_LO, SP
+from .simulation import BatchPID, BatchPlant
+
+
+HYPO_THRESHOLD = 3.9 # [mmol/L]
+HYPO_WEIGHT = 100.0
+
+
+def default_candidates(ISF=ISF):
+    # Grid of (Kc, tauI) pairs around Kc = -1/ISF from the PID chapter
+    Kc = -np.linspace(0.1, 2.0, 20)/ISF
+    tauI = np.logspace(1, 3.5, 12) # [min]
+    Kc, tauI = np.meshgrid(Kc, tauI, indexing='ij')
+    return Kc.ravel(), tauI.ravel()
+
+
+def tune_pid(cohort, Kc=None, tauI=None, sp=SP, op_hi=OP_HI, op_lo=OP_LO, hypo_threshold=HYPO_THRESHOLD,
+             hypo_weight=HYPO_WEIGHT, batch_size=64, checkpoint_steps=24, prune_ratio=3.0):
+    if Kc is None or tauI is None:
+        Kc, tauI = default_candidates(np.mean(cohort.ISF))
+    Kc = np.asarray(Kc, dtype=float).ravel()
+    tauI = np.asarray(tauI, dtype=float).ravel()
+    assert (len(Kc) == len(tauI)), "Unequal number of candidates (Kc : {}) (tauI : {}).".format(len(Kc), len(tauI))
+
+    dt = cohort.T/60 # [hours]
+    costs = np.full(len(Kc), np.nan)
+    best = np.inf
+
+    for start in range(0, len(Kc), batch_size):
+        idx = np.arange(start, min(start + batch_size, len(Kc)))
+        plant = BatchPlant(cohort, len(idx))
+        controller = BatchPID(Kc[idx], tauI[idx], cohort, sp, op_hi, op_lo)
+        cost = np.zeros((len(idx), cohort.n_patients))
+
+        pv = plant.BG
+        for i in range(cohort.ns):
+            pv = plant.step(controller.step(pv))
+            t = (i + 1)*dt
+            cost += t*np.abs(sp - pv)*dt + hypo_weight*np.maximum(hypo_threshold - pv, 0)*dt
+
+            if (i + 1) % checkpoint_steps == 0 and i + 1 < cohort.ns:
+                partial = cost.mean(axis=1)
+                keep = partial <= best
+                if prune_ratio is not None:
+                    keep &= partial <= prune_ratio*partial.min()
+                if not keep.all():
+                    idx = idx[keep]
+                    cost = cost[keep]
+                    plant.take(keep)
+                    controller.take(keep)
+                    pv = plant.BG
+                if len(idx) == 0:
+                    break
+
+        if len(idx) > 0:
+            costs[idx] = cost.mean(axis=1)
+            best = min(best, np.nanmin(costs))
+
+    i = np.nanargmin(costs)
+    return (Kc[i], tauI[i], costs)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from ap_control.estimation import _curve_weights, fit_patient_parameters
+
+
+def synthetic_history(n_patients, days=5, T=5, seed=0):
+    rng = np.random.default_rng(seed)
+    ns = days*24*60//T
+    truth = {
+        'ISF': rng.uniform(1, 4, n_patients),
+        'basal_rate': rng.uniform(0.5, 1.5, n_patients),
+        'peak_activity': rng.uniform(55, 95, n_patients),
+        'total_activity': rng.uniform(150, 300, n_patients),
+    }
+    doses = truth['basal_rate'][:, None]*T/60*rng.uniform(0, 2, (n_patients, ns))
+    doses[:, ::60] += rng.uniform(0, 3, (n_patients, 1))
+
+    n_lags = 96
+    w = _curve_weights(truth['peak_activity'], truth['total_activity'], n_lags, T, 10)
+    used = np.zeros(doses.shape)
+    for lag in range(n_lags):
+        used[:, lag:] += w[:, lag:lag + 1]*doses[:, :ns - lag]
+    dBG = -truth['ISF'][:, None]*used + (truth['ISF']*truth['basal_rate']*T/60)[:, None] + rng.normal(0, 0.02, used.shape)
+    BG = 7 + np.concatenate([np.zeros((n_patients, 1)), np.cumsum(dBG, axis=1)], axis=1)
+    return BG, doses, truth
+
+
+def test_recovers_parameters():
+    BG, doses, truth = synthetic_history(20)
+    params = fit_patient_parameters(BG, doses)
+    assert np.median(np.abs(params.ISF/truth['ISF'] - 1)) < 0.05
+    assert np.median(np.abs(params.basal_rate/truth['basal_rate'] - 1)) < 0.05
+    assert np.median(np.abs(params.peak_activity - truth['peak_activity'])) < 5
+    assert np.median(np.abs(params.total_activity - truth['total_activity'])) < 10
+
+
+def test_warm_start_does_not_get_worse():
+    BG, doses, _ = synthetic_history(10, seed=1)
+    params = fit_patient_parameters(BG, doses)
+    refit = fit_patient_parameters(BG, doses, initial=params)
+    assert np.all(refit.sse <= params.sse + 1e-12)
+
+
+def test_chunked_processes_match_single_process():
+    BG, doses, _ = synthetic_history(12, days=3, seed=2)
+    params = fit_patient_parameters(BG, doses)
+    parallel = fit_patient_parameters(BG, doses, n_jobs=2, chunk_size=5)
+    np.testing.assert_allclose(parallel.ISF, params.ISF)
+    np.testing.assert_allclose(parallel.peak_activity, params.peak_activity)
+
+
+def test_rejects_mismatched_lengths():
+    with pytest.raises(AssertionError):
+        fit_patient_parameters(np.zeros((1, 10)), np.zeros((1, 10)))
+
+
+def test_rejects_history_without_fittable_timesteps():
+    # 480 minutes of history are needed before the first fitted timestep, and
+    # the linear fit needs at least two timesteps
+    for n in [50, 97, 98]:
+        with pytest.raises(AssertionError):
+            fit_patient_parameters(np.full((2, n), 6.0), np.ones((2, n - 1)))
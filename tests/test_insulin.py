@@ -0,0 +1,56 @@
+import tracemalloc
+
+import numpy as np
+
+from ap_control.insulin import IOBTracker, calc_insulin_activity, remaining_insulin_effect
+from ap_control.mpc import effect_matrix
+
+
+def test_activity_curve_has_unit_area():
+    t = np.linspace(0, 200, 200001)
+    assert abs(np.trapezoid(calc_insulin_activity(t), t) - 100) < 1e-3
+    assert remaining_insulin_effect(0) == 100
+    assert remaining_insulin_effect(180) == 0
+
+
+def test_tracker_matches_closed_form():
+    rng = np.random.default_rng(0)
+    tracker = IOBTracker()
+    doses = []
+    for step in range(2000):
+        tracker.step()
+        dose = rng.uniform(0, 2)
+        tracker.add(dose)
+        doses.append(dose)
+        if step % 50 == 0:
+            tracker.check_consistency(atol=1e-9)
+            recent = np.array(doses[-tracker.n_slots:])
+            age = np.arange(len(recent) - 1, -1, -1)
+            closed_form = recent @ remaining_insulin_effect(tracker.T*age)/100
+            assert abs(tracker.iob() - closed_form) < 1e-9
+
+
+def test_used_matches_effect_matrix():
+    rng = np.random.default_rng(1)
+    tracker = IOBTracker()
+    doses = rng.uniform(0, 1, 100)
+    for dose in doses:
+        tracker.step()
+        tracker.add(dose)
+    horizon = 50
+    expected = doses[-tracker.n_slots:] @ effect_matrix(tracker.n_slots, horizon)
+    np.testing.assert_allclose(tracker.used(np.zeros(horizon)), expected, atol=1e-12)
+
+
+def test_step_does_not_allocate():
+    tracker = IOBTracker()
+    for _ in range(100):
+        tracker.step()
+        tracker.add(0.5)
+    tracemalloc.start()
+    for _ in range(10000):
+        tracker.step()
+        tracker.add(0.5)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 10000
@@ -0,0 +1,65 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import ap_control
+from ap_control.clarke import clarke_zones, zone_counts
+
+
+def test_import_is_lazy():
+    code = ("import sys, ap_control; "
+            "assert 'numpy' not in sys.modules, 'numpy'; "
+            "assert not any(m.startswith('matplotlib') for m in sys.modules), 'matplotlib'; "
+            "ap_control.zone_counts; "
+            "assert not any(m.startswith('matplotlib') for m in sys.modules), 'matplotlib'")
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+def test_exports_resolve():
+    for name, module in ap_control._EXPORTS.items():
+        assert getattr(ap_control, name) is getattr(sys.modules['ap_control.' + module], name)
+    assert set(ap_control.__all__) <= set(dir(ap_control))
+
+
+def test_unknown_attribute():
+    with pytest.raises(AttributeError):
+        ap_control.not_a_name
+
+
+def reference_zone(ref, pred):
+    # Zone conditions of the original ClarkeErrorGrid loop, for one point
+    if (ref <= 70 and pred <= 70) or (pred <= 1.2*ref and pred >= 0.8*ref):
+        return 0
+    if (ref >= 180 and pred <= 70) or (ref <= 70 and pred >= 180):
+        return 4
+    if ((ref >= 70 and ref <= 290) and pred >= ref + 110) or ((ref >= 130 and ref <= 180) and (pred <= (7/5)*ref - 182)):
+        return 2
+    if (ref >= 240 and (pred >= 70 and pred <= 180)) or (ref <= 175/3 and pred <= 180 and pred >= 70) or \
+            ((ref >= 175/3 and ref <= 70) and pred >= (6/5)*ref):
+        return 3
+    return 1
+
+
+def test_zones_match_original_loop():
+    rng = np.random.default_rng(0)
+    ref = rng.uniform(0, 400, 5000)
+    pred = rng.uniform(0, 400, 5000)
+    expected = [reference_zone(r, p) for r, p in zip(ref, pred)]
+    np.testing.assert_array_equal(clarke_zones(ref, pred), expected)
+    assert zone_counts(ref, pred) == np.bincount(expected, minlength=5).tolist()
+
+
+def test_script_reexport():
+    pytest.importorskip('matplotlib')
+    import matplotlib
+    matplotlib.use('Agg')
+    import ClarkeErrorGrid
+
+    assert ClarkeErrorGrid.clarke_error_grid is ap_control.clarke_error_grid
+    ref = [50, 100, 200, 300, 150]
+    pred = [55, 300, 60, 150, 151]
+    plot, zone = ClarkeErrorGrid.clarke_error_grid(ref, pred, 'test')
+    assert zone == zone_counts(ref, pred)
+    plot.close('all')
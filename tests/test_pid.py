@@ -0,0 +1,89 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from ap_control.pid import TRACES, PIDController, calc_response
+
+
+NS = 1200
+T = np.linspace(0, NS, NS + 1)
+SP = np.full(NS + 1, 6.0)
+PV = np.sin(T*0.01)*2 + 6
+
+
+def notebook_calc_response(t, Kc, tauI, sp, pv, basal_rate=1.0, op_hi=10.0, op_lo=0.0):
+    # calc_response as written in the PID chapter, with pv as an argument
+    ns = len(t)-1
+    delta_t = t[1]-t[0]
+    op = np.zeros(ns+1)
+    e = np.zeros(ns+1)
+    ie = np.zeros(ns+1)
+    dpv = np.zeros(ns+1)
+    P = np.zeros(ns+1)
+    I = np.zeros(ns+1)
+    for i in range(0,ns):
+        e[i] = sp[i] - pv[i]
+        if i >= 1:
+            dpv[i] = (pv[i]-pv[i-1])/delta_t
+            ie[i] = ie[i-1] + e[i] * delta_t
+        P[i] = Kc * e[i]
+        I[i] = Kc/tauI * ie[i]
+        op[i] = basal_rate + P[i] + I[i]
+        if op[i] > op_hi:
+            op[i] = op_hi
+            ie[i] = ie[i] - e[i] * delta_t
+        if op[i] < op_lo:
+            op[i] = op_lo
+            ie[i] = ie[i] - e[i] * delta_t
+    op[ns] = op[ns-1]
+    ie[ns] = ie[ns-1]
+    P[ns] = P[ns-1]
+    I[ns] = I[ns-1]
+    return dict(pv=pv, op=op, e=e, ie=ie, dpv=dpv, P=P, I=I)
+
+
+def test_matches_notebook():
+    expected = notebook_calc_response(T, -0.5, 10.0, SP, PV)
+    pv, op = calc_response(T, -0.5, 10.0, SP, PV)
+    np.testing.assert_array_equal(pv, PV)
+    np.testing.assert_array_equal(op, expected['op'])
+
+    traces = calc_response(T, -0.5, 10.0, SP, PV, traces=TRACES)
+    for name, trace in zip(TRACES, traces):
+        np.testing.assert_array_equal(trace, expected[name])
+
+
+def test_pv_trace_is_a_copy():
+    pv, = calc_response(T, -0.5, 10.0, SP, PV, traces=('pv',))
+    assert not np.shares_memory(pv, PV)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_only_requested_traces_are_stored(dtype):
+    pv = PV.astype(dtype)
+    calc_response(T, -0.5, 10.0, SP, pv, traces=('op',), dtype=dtype)
+    tracemalloc.start()
+    op, = calc_response(T, -0.5, 10.0, SP, pv, traces=('op',), dtype=dtype)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert op.dtype == dtype
+    assert peak < 1.5*(NS + 1)*np.dtype(dtype).itemsize + 4096
+
+
+def test_float32_traces_are_close():
+    _, op = calc_response(T, -0.5, 10.0, SP, PV)
+    _, op32 = calc_response(T, -0.5, 10.0, SP, PV, dtype=np.float32)
+    np.testing.assert_allclose(op32, op, rtol=1e-6)
+
+
+def test_unknown_trace():
+    with pytest.raises(AssertionError):
+        calc_response(T, -0.5, 10.0, SP, PV, traces=('x',))
+
+
+def test_controller_matches_calc_response_without_clamping():
+    pv = np.sin(T*0.01)*0.5 + 6
+    _, op = calc_response(T, -0.5, 1000.0, SP, pv)
+    controller = PIDController(Kc=-0.5, tauI=1000.0)
+    np.testing.assert_allclose([controller.step(v) for v in pv[:-1]], op[:-1])
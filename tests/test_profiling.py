@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+
+from ap_control.mpc import MPCController
+from ap_control.pid import PIDController
+from ap_control.profiling import NULL_PROFILER, ControllerProfiler
+
+
+def test_disabled_profiler_records_nothing():
+    controller = MPCController()
+    controller.step(10.0)
+    assert controller.profiler is NULL_PROFILER
+    assert NULL_PROFILER.snapshot() == {'stages': {}, 'counters': {}}
+
+
+def test_snapshot_is_json_with_stages_and_counters():
+    profiler = ControllerProfiler()
+    controller = MPCController(profiler=profiler)
+    for BG in [12.0, 11.0, 10.0]:
+        controller.step(BG)
+
+    snapshot = json.loads(profiler.to_json())
+    assert snapshot['stages']['predict']['count'] == 3
+    assert snapshot['stages']['optimize']['count'] == 3
+    for stats in snapshot['stages'].values():
+        assert 0 <= stats['p50_ms'] <= stats['p99_ms'] <= stats['max_ms']
+    assert snapshot['counters']['optimizer_iterations'] == 3*len(controller.candidates)
+
+
+def test_clamp_and_anti_windup_counters():
+    profiler = ControllerProfiler()
+    controller = PIDController(op_hi=2.0, profiler=profiler)
+    for pv in [20.0, 20.0, 20.0]:
+        assert controller.step(pv) == 2.0
+
+    counters = profiler.snapshot()['counters']
+    assert counters['clamp_hi'] == 3
+    assert counters['anti_windup'] == 3
+
+
+def test_nested_stages_with_same_name():
+    profiler = ControllerProfiler()
+    with profiler.stage('step'):
+        with profiler.stage('step'):
+            pass
+        time.sleep(0.01)
+
+    stats = profiler.snapshot()['stages']['step']
+    assert stats['count'] == 2
+    assert stats['max_ms'] >= 10
+
+
+def test_stages_from_several_threads():
+    profiler = ControllerProfiler()
+
+    def work():
+        for _ in range(100):
+            with profiler.stage('step'):
+                time.sleep(0.0001)
+            profiler.count('steps')
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    snapshot = profiler.snapshot()
+    assert snapshot['stages']['step']['count'] == 400
+    assert snapshot['counters']['steps'] == 400
+    assert snapshot['stages']['step']['max_ms'] < 1000
@@ -0,0 +1,81 @@
+import math
+
+import numpy as np
+import pytest
+
+from ap_control.insulin import IOBTracker
+from ap_control.mpc import MPCController
+from ap_control.pid import PIDController
+from ap_control.profiling import ControllerProfiler
+from ap_control.replay import Replay, read_log, replay_many, run_replay
+
+
+def write_log(path, days=3, seed=0):
+    # Log of a patient under MPC, with a measurement missing every 50 records
+    rng = np.random.default_rng(seed)
+    tracker = IOBTracker()
+    controller = MPCController(ISF=2.5)
+    BG = 9.0
+    lines = ['timestamp,BG,dose\n']
+    for k in range(288*days):
+        meal = 0.15 if 100 <= k % 288 < 124 else 0.0
+        dose = controller.step(BG)
+        tracker.add(dose)
+        used = tracker.step()
+        lines.append('{},{},{}\n'.format(5*k, '' if k % 50 == 7 else round(BG, 2), dose))
+        BG = BG + meal - 2.0*used + rng.normal(0, 0.05)
+    path.write_text(''.join(lines))
+    return path
+
+
+@pytest.mark.parametrize('controller', [MPCController(), PIDController(delta_t=5)])
+def test_dose_during_cgm_gap_is_on_board(controller):
+    replay = Replay(controller)
+    replay.feed(0.0, 8.0, 0.0)
+    replay.feed(5.0, math.nan, 1.0)
+    assert math.isnan(replay.counterfactual[-1])
+    assert controller.iob() == pytest.approx(1.0)
+
+
+def test_summary(tmp_path):
+    replay = run_replay(read_log(write_log(tmp_path/'log.csv')), MPCController(ISF=2.0))
+    summary = replay.summary()
+    assert summary['steps'] == 288*3
+    assert len(summary['mae']) == len(summary['clarke_zones']) == MPCController().horizon
+    assert summary['mae'][0] < summary['mae'][-1]
+    assert all(sum(zones) > 0 for zones in summary['clarke_zones'])
+
+
+def test_checkpoint_resume_matches_full_replay(tmp_path):
+    log = write_log(tmp_path/'log.csv')
+    records = list(read_log(log))
+    full = run_replay(records, MPCController(ISF=2.0)).summary()
+
+    checkpoint = str(tmp_path/'replay.ckpt')
+    run_replay(records[:500], MPCController(ISF=2.0), checkpoint, checkpoint_every=100)
+    resumed = run_replay(records, MPCController(ISF=2.0), checkpoint)
+    assert resumed.summary() == full
+
+
+def test_replay_many_matches_run_replay(tmp_path):
+    log = str(write_log(tmp_path/'log.csv', days=1))
+    summaries = replay_many({'mpc': (log, MPCController(ISF=2.0)), 'pid': (log, PIDController(delta_t=5))}, n_jobs=2)
+    assert summaries['mpc'] == run_replay(read_log(log), MPCController(ISF=2.0)).summary()
+    assert summaries['pid']['steps'] == 288
+
+
+def test_checkpoint_profiled_controller(tmp_path):
+    log = write_log(tmp_path/'log.csv', days=1)
+    records = list(read_log(log))
+    checkpoint = str(tmp_path/'replay.ckpt')
+    profiler = ControllerProfiler()
+    run_replay(records[:100], MPCController(ISF=2.0, profiler=profiler), checkpoint)
+    assert Replay.load(checkpoint).controller.profiler.snapshot() == profiler.snapshot()
+
+    resumed = run_replay(records, None, checkpoint)
+    assert resumed.summary() == run_replay(records, MPCController(ISF=2.0)).summary()
+    assert resumed.controller.profiler.snapshot()['counters']['optimizer_iterations'] > \
+        profiler.snapshot()['counters']['optimizer_iterations']
+
+    summaries = replay_many({'mpc': (str(log), MPCController(ISF=2.0, profiler=ControllerProfiler()))}, n_jobs=1)
+    assert summaries['mpc']['steps'] == 288
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from ap_control.insulin import IOBTracker
+from ap_control.mpc import MPCController
+from ap_control.pid import PIDController
+from ap_control.safety import SafetyConstraints
+
+
+ALL = SafetyConstraints(max_bolus=2.0, max_basal=3.0, max_rate_change=0.5, max_iob=5.0, suspend_below=3.9)
+
+
+def random_inputs(rng, n):
+    return (rng.uniform(-1, 6, n), rng.uniform(0, 4, n), rng.uniform(0, 7, n), rng.uniform(2, 10, n))
+
+
+@pytest.mark.parametrize('rate', [False, True])
+def test_never_raises_delivery(rate):
+    rng = np.random.default_rng(0)
+    u, previous, iob, predicted_min = random_inputs(rng, 5000)
+    clipped = ALL.apply(u, previous, iob, predicted_min, rate=rate, basal_rate=1.0)
+    assert np.all(clipped <= np.maximum(u, 0))
+    for i in range(500):
+        assert ALL.apply(u[i], previous[i], iob[i], predicted_min[i], rate=rate, basal_rate=1.0) <= max(u[i], 0)
+
+
+@pytest.mark.parametrize('rate', [False, True])
+def test_scalar_and_vectorized_paths_agree(rate):
+    rng = np.random.default_rng(1)
+    u, previous, iob, predicted_min = random_inputs(rng, 1000)
+    vectorized = ALL.apply(u, previous, iob, predicted_min, rate=rate, basal_rate=1.0)
+    scalar = [ALL.apply(*args, rate=rate, basal_rate=1.0) for args in zip(u, previous, iob, predicted_min)]
+    np.testing.assert_allclose(vectorized, scalar)
+
+
+def test_rate_of_change_only_limits_increases():
+    constraints = SafetyConstraints(max_rate_change=0.5)
+    assert constraints.apply(0.0, 2.0) == 0.0
+    assert constraints.apply(3.0, 2.0) == 2.5
+    lo, hi = constraints.bounds(1.0, horizon=3)
+    np.testing.assert_array_equal(lo, [0, 0, 0])
+    np.testing.assert_array_equal(hi, [1.5, 2.0, 2.5])
+
+
+def test_bounds_shape_over_patients_and_horizon():
+    lo, hi = ALL.bounds(np.zeros(4), np.zeros(4), np.full(4, 8.0), horizon=6)
+    assert lo.shape == hi.shape == (4, 6)
+    assert np.all(lo <= hi)
+
+
+@pytest.mark.parametrize('decay', [False, True])
+def test_iob_ceiling_holds_over_the_horizon(decay):
+    constraints = SafetyConstraints(max_iob=5.0)
+    assert constraints.bounds(0.0, iob=4.0, horizon=4)[1].sum() < 1.01
+
+    rng = np.random.default_rng(2)
+    for _ in range(50):
+        tracker = IOBTracker()
+        for dose in rng.uniform(0, 0.5, 10):
+            tracker.add(dose)
+            tracker.step()
+        horizon = 24
+        iob_used = tracker.used(np.zeros(horizon)) if decay else None
+        _, hi = constraints.bounds(0.0, tracker.iob(), horizon=horizon, iob_used=iob_used)
+        doses = hi*rng.uniform(0.5, 1.0, horizon)
+        for dose in doses:
+            tracker.add(dose)
+            assert tracker.iob() <= 5.0 + 1e-9
+            tracker.step()
+
+
+def test_iob_ceiling_and_suspend():
+    assert ALL.apply(2.0, 2.0, iob=4.5, predicted_min=8.0) == 0.5
+    assert ALL.apply(2.0, 2.0, iob=0.0, predicted_min=3.0) == 0.0
+    # Rate outputs: suspending stops the basal rate too
+    assert ALL.apply(1.0, 1.0, iob=0.0, predicted_min=3.0, rate=True, basal_rate=1.0) == 0.0
+
+
+def test_mpc_does_not_dose_when_optimizer_chooses_not_to():
+    controller = MPCController(constraints=SafetyConstraints(max_rate_change=0.5))
+    for _ in range(5):
+        controller.step(20.0)
+    assert [controller.step(BG) for BG in [6.0, 5.0, 4.5, 4.2]] == [0.0, 0.0, 0.0, 0.0]
+
+
+def test_pid_respects_max_basal_and_suspend():
+    controller = PIDController(constraints=SafetyConstraints(max_basal=2.0, suspend_below=3.9))
+    assert all(controller.step(pv) <= 2.0 for pv in [15.0, 16.0, 17.0])
+    controller = PIDController(constraints=SafetyConstraints(suspend_below=3.9))
+    assert controller.step(3.5) == 0.0
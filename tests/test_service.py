@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from ap_control.mpc import MPCController, step_batch
+from ap_control.pid import PIDController
+from ap_control.profiling import ControllerProfiler
+from ap_control.safety import SafetyConstraints
+from ap_control.service import ControlService, FileSource, SimulatedPump, SocketSource
+
+
+CONSTRAINTS = SafetyConstraints(max_bolus=1.0, max_iob=3.0, suspend_below=3.9)
+
+
+def test_step_batch_matches_step():
+    rng = np.random.default_rng(0)
+    for constraints in [None, CONSTRAINTS]:
+        ISF = rng.uniform(1, 4, 30)
+        single = [MPCController(ISF=i, constraints=constraints) for i in ISF]
+        batch = [MPCController(ISF=i, constraints=constraints) for i in ISF]
+        for _ in range(50):
+            BG = rng.uniform(3, 15, len(ISF))
+            expected = [controller.step(b) for controller, b in zip(single, BG)]
+            np.testing.assert_allclose(step_batch(batch, BG), expected)
+
+
+def test_step_batch_counts_its_own_counter():
+    profiler = ControllerProfiler()
+    step_batch([MPCController(), MPCController()], [10.0, 12.0], profiler)
+    counters = profiler.snapshot()['counters']
+    assert counters['batch_optimizations'] == 2
+    assert 'optimizer_iterations' not in counters
+
+
+def test_file_source_matches_sequential_controllers(tmp_path):
+    rng = np.random.default_rng(1)
+    path = tmp_path / 'readings.csv'
+    readings = [('p{}'.format(p), 5.0*k, round(rng.uniform(4, 14), 2)) for k in range(10) for p in range(20)]
+    path.write_text(''.join('{},{},{}\n'.format(*reading) for reading in readings))
+
+    def factory(patient_id):
+        if int(patient_id[1:]) % 2:
+            return PIDController(delta_t=5, constraints=CONSTRAINTS)
+        return MPCController(constraints=CONSTRAINTS)
+
+    sink = SimulatedPump()
+    asyncio.run(ControlService(factory, FileSource(path), sink, max_pending=50, max_batch=16).run())
+
+    for p in range(20):
+        patient_id = 'p{}'.format(p)
+        controller = factory(patient_id)
+        expected = [(t, controller.step(BG)) for pid, t, BG in readings if pid == patient_id]
+        assert sink.deliveries[patient_id] == expected
+
+
+class CountingSource:
+    # Single patient source that remembers how far ahead of the pump it got
+
+    def __init__(self, sink, n):
+        self.sink = sink
+        self.n = n
+        self.max_ahead = 0
+
+    async def readings(self):
+        for k in range(self.n):
+            delivered = len(self.sink.deliveries['a'])
+            self.max_ahead = max(self.max_ahead, k - delivered)
+            yield ('a', 5.0*k, 8.0)
+
+
+def test_backpressure_with_a_single_patient():
+    sink = SimulatedPump()
+    source = CountingSource(sink, 5000)
+    asyncio.run(ControlService(lambda patient_id: MPCController(), source, sink, max_pending=100).run())
+    assert len(sink.deliveries['a']) == 5000
+    assert source.max_ahead <= 100 + 3
+
+
+def test_socket_source():
+    async def run():
+        source = SocketSource()
+        await source.start()
+        sink = SimulatedPump()
+        task = asyncio.create_task(ControlService(lambda patient_id: MPCController(), source, sink).run())
+        reader, writer = await asyncio.open_connection('127.0.0.1', source.port)
+        for k in range(3):
+            writer.write('a,{},10\nb,{},12\n'.format(5*k, 5*k).encode())
+        await writer.drain()
+        writer.close()
+        await asyncio.sleep(0.1)
+        await source.close()
+        await task
+        return sink
+
+    sink = asyncio.run(run())
+    assert [t for t, _ in sink.deliveries['a']] == [0.0, 5.0, 10.0]
+    assert [t for t, _ in sink.deliveries['b']] == [0.0, 5.0, 10.0]
+
+
+def test_source_error_is_raised(tmp_path):
+    path = tmp_path / 'readings.csv'
+    path.write_text('a,0,10\nbad line\na,5,10\n')
+    sink = SimulatedPump()
+    service = ControlService(lambda patient_id: MPCController(), FileSource(path), sink)
+    with pytest.raises(ValueError):
+        asyncio.run(asyncio.wait_for(service.run(), 10))
+    assert [t for t, _ in sink.deliveries['a']] == [0.0]
+
+
+def test_worker_thread_is_stopped():
+    threads = threading.active_count()
+    services = []
+    for _ in range(5):
+        sink = SimulatedPump()
+        services.append(ControlService(lambda patient_id: MPCController(), CountingSource(sink, 10), sink))
+        asyncio.run(services[-1].run())
+    time.sleep(0.1)
+    assert threading.active_count() <= threads
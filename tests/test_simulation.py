@@ -0,0 +1,35 @@
+import tracemalloc
+
+import numpy as np
+
+from ap_control.simulation import random_cohort, simulate_pid
+
+
+def test_chunked_float32_memmap_matches_in_memory(tmp_path):
+    cohort = random_cohort(40, days=2, seed=0)
+    pv, op = simulate_pid([-0.5, -0.3], [100.0, 300.0], cohort)
+    op32, = simulate_pid([-0.5, -0.3], [100.0, 300.0], cohort, traces=('op',), dtype=np.float32,
+                         chunk_size=7, out_dir=str(tmp_path))
+
+    assert isinstance(op32, np.memmap)
+    assert op32.dtype == np.float32 and op32.shape == op.shape
+    np.testing.assert_allclose(op32, op, rtol=1e-6, atol=1e-6)
+    assert not (tmp_path/'pv.npy').exists()
+    np.testing.assert_allclose(np.load(tmp_path/'op.npy'), op32)
+
+
+def test_memmap_cohort_matches_in_memory(tmp_path):
+    cohort = random_cohort(30, days=2, seed=1)
+    stored = random_cohort(30, days=2, seed=1, dtype=np.float32, path=str(tmp_path/'d.npy'), chunk_size=8)
+    np.testing.assert_allclose(stored.disturbance, cohort.disturbance, atol=1e-6)
+    np.testing.assert_array_equal(stored.ISF, cohort.ISF)
+
+
+def test_out_dir_is_chunked_by_default(tmp_path):
+    cohort = random_cohort(8000, days=1, seed=2)
+    simulate_pid(-0.5, 100.0, cohort.take(slice(0, 10)), traces=('op',), dtype=np.float32, out_dir=str(tmp_path))
+    tracemalloc.start()
+    op, = simulate_pid(-0.5, 100.0, cohort, traces=('op',), dtype=np.float32, out_dir=str(tmp_path))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < op.nbytes/3
@@ -0,0 +1,38 @@
+import numpy as np
+
+from ap_control.pid import PIDController, calc_response
+from ap_control.simulation import BatchPID, random_cohort, simulate_pid
+from ap_control.tuning import tune_pid
+
+
+def test_batch_pid_matches_calc_response():
+    cohort = random_cohort(3, seed=0)
+    t = cohort.T*np.arange(cohort.ns + 1)
+    pv = np.sin(t*0.01)*8 + 6  # Large enough to clamp on the first step
+    for p in range(cohort.n_patients):
+        _, op = calc_response(t, -0.5, 10.0, np.full(len(t), 6.0), pv, basal_rate=cohort.basal_rate[p])
+        controller = BatchPID([-0.5], [10.0], cohort.take([p]))
+        batch = [controller.step(np.array([[v]]))[0, 0] for v in pv[:-1]]
+        np.testing.assert_allclose(batch, op[:-1])
+
+
+def test_batch_pid_matches_pid_controller():
+    cohort = random_cohort(4, seed=1)
+    pv, op = simulate_pid([-0.4], [200.0], cohort)
+    for p in range(cohort.n_patients):
+        controller = PIDController(Kc=-0.4, tauI=200.0, delta_t=cohort.T, basal_rate=cohort.basal_rate[p])
+        np.testing.assert_allclose([controller.step(v) for v in pv[0, p, :-1]], op[0, p, :-1])
+
+
+def test_pruning_finds_the_exhaustive_optimum():
+    cohort = random_cohort(30, seed=2)
+    Kc, tauI, costs = tune_pid(cohort)
+    Kc_all, tauI_all, costs_all = tune_pid(cohort, prune_ratio=None, checkpoint_steps=cohort.ns + 1)
+
+    assert not np.isnan(costs_all).any()
+    assert np.isnan(costs).any()  # Some candidates were pruned
+    assert (Kc, tauI) == (Kc_all, tauI_all)
+    assert np.nanmin(costs) == np.min(costs_all)
+    finished = ~np.isnan(costs)
+    np.testing.assert_allclose(costs[finished], costs_all[finished])
+